@@ -1,18 +1,22 @@
 import argparse
 import collections
+import concurrent.futures
+import functools
 import json
 import openreview
 import os
+import requests
+import threading
 import tqdm
 
+import crawl_lib
 import scc_lib
 
 parser = argparse.ArgumentParser(description='')
 parser.add_argument('-o',
                     '--output_dir',
                     type=str,
-                    help='directory to dump pdfs',
-                    required=True)
+                    help='directory to dump pdfs (required unless merging)')
 parser.add_argument("-c",
                     "--conference",
                     type=str,
@@ -24,6 +28,50 @@ parser.add_argument('-s',
                     default='./statuses/status_',
                     type=str,
                     help='prefix for tsv file with status of all forums')
+parser.add_argument('-j',
+                    '--journal_file_prefix',
+                    default='./statuses/journal_',
+                    type=str,
+                    help='prefix for jsonl log of completed forums; forums '
+                    'already in it are skipped')
+parser.add_argument('-b',
+                    '--blob_dir',
+                    default='./blobs/',
+                    type=str,
+                    help='content-addressed store shared by all forum pdfs')
+parser.add_argument('--cache_dir',
+                    default=None,
+                    type=str,
+                    help='directory for recorded OpenReview responses')
+parser.add_argument('--cache_mode',
+                    default=crawl_lib.CachingClient.RECORD,
+                    choices=crawl_lib.CachingClient.MODES,
+                    help='record: fetch and store missing responses; '
+                    'replay: redo every forum offline from recorded '
+                    'responses only, with its own journal and status file')
+parser.add_argument('-r',
+                    '--max_rate',
+                    default=5.0,
+                    type=float,
+                    help='maximum OpenReview requests per second')
+parser.add_argument('-w',
+                    '--workers',
+                    default=1,
+                    type=int,
+                    help='number of forums to retrieve concurrently')
+parser.add_argument('--incremental',
+                    action='store_true',
+                    help='also re-fetch completed forums that changed since '
+                    'they were retrieved')
+parser.add_argument('--shard',
+                    default=None,
+                    type=crawl_lib.parse_shard,
+                    help='only retrieve shard i/N of the forums, with its '
+                    'own journal and status file')
+parser.add_argument('--merge_shards',
+                    action='store_true',
+                    help='merge the journals of all shards into one status '
+                    'file, then exit')
 
 # == OpenReview-specific stuff ===============================================
 
@@ -41,7 +89,15 @@ class PDFStatus(object):
     NOT_FOUND = "not_found"
 
 
-GUEST_CLIENT = openreview.Client(baseurl="https://api.openreview.net")
+API_BASEURL = "https://api.openreview.net"
+
+# Created on first use by get_guest_client(), with its requests scheduled by
+# SCHEDULER, and possibly wrapped in a crawl_lib.CachingClient by main()
+GUEST_CLIENT = None
+
+# Every OpenReview request goes through this, for rate limiting and retries;
+# responses served from the cache do not
+SCHEDULER = crawl_lib.RequestScheduler()
 
 PDF_ERROR_STATUS_LOOKUP = {
     "ForbiddenError": PDFStatus.FORBIDDEN,
@@ -56,10 +112,25 @@ INVITATIONS = {
     for year in range(2018, 2023)
 }
 
+
+def get_guest_client():
+    global GUEST_CLIENT
+    if GUEST_CLIENT is None:
+        client = openreview.Client(baseurl=API_BASEURL)
+        # SCHEDULER retries failed calls itself; retries hidden inside the
+        # session would defeat its backoff and adaptive concurrency
+        for prefix in ['https://', 'http://']:
+            client.session.mount(prefix,
+                                 requests.adapters.HTTPAdapter(max_retries=0))
+        GUEST_CLIENT = crawl_lib.ScheduledClient(client, SCHEDULER)
+    return GUEST_CLIENT
+
+
 # == Other helpers ===========================================================
 
-Review = collections.namedtuple("Review",
-                                "review_id sentences rating reviewer tcdate")
+# `sentences` stays None until 00a_sentencize_reviews.py fills it in
+Review = collections.namedtuple(
+    "Review", "review_id text sentences rating reviewer tcdate")
 
 
 class ForumStatus(object):
@@ -67,57 +138,82 @@ class ForumStatus(object):
     NO_REVIEWS = "no_reviews"
     NO_PDF = "no_pdf"
     NO_REVISION = "no_revision"
+    ERROR = "error"  # retried on the next run
 
 
-# ============================================================================
+class ForumError(Exception):
+    """Retrieving a forum failed after its decision was known; raised from
+    the error that ended it."""
 
+    def __init__(self, decision):
+        super().__init__(decision)
+        self.decision = decision
 
-def get_binary(note):
-    try:  # try to get the PDF for this paper revision
-        pdf_binary = GUEST_CLIENT.get_pdf(note.id, is_reference=True)
-        pdf_status = PDFStatus.AVAILABLE
-    except openreview.OpenReviewException as e:
-        pdf_status = PDF_ERROR_STATUS_LOOKUP[e.args[0]["name"]]
-        pdf_binary = None
-    return pdf_status, pdf_binary
+
+# ============================================================================
 
 
-def write_pdfs(forum_dir, initial_binary, final_binary):
-    for binary, version in [(initial_binary, scc_lib.INITIAL),
-                            (final_binary, scc_lib.FINAL)]:
-        assert binary is not None
-        with open(f'{forum_dir}/{version}.pdf', "wb") as f:
-            f.write(binary)
+def write_chunks(path, chunks):
+    with open(path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
 
 
-def get_last_valid_reference(references):
+def stage_pdf(note, staging_dir):
+    # Downloaded pdfs wait in `staging_dir`; only the ones selected for the
+    # forum are put into the blob store
+    path = os.path.join(staging_dir, f'{note.id}.pdf')
+    try:  # try to get the PDF for this paper revision
+        get_guest_client().download_pdf(functools.partial(write_chunks, path),
+                                        note.id,
+                                        is_reference=True)
+        pdf_status = PDFStatus.AVAILABLE
+    except openreview.OpenReviewException as e:
+        error_name = crawl_lib.error_details(e).get("name")
+        if error_name not in PDF_ERROR_STATUS_LOOKUP:
+            raise  # the scheduler already retried it
+        pdf_status = PDF_ERROR_STATUS_LOOKUP[error_name]
+        path = None
+    return pdf_status, path
+
+
+def write_pdfs(forum_dir, initial_path, final_path, blob_store):
+    # Each distinct pdf is stored once; forum directories hold hardlinks
+    digests = {}
+    for path, version in [(initial_path, scc_lib.INITIAL),
+                          (final_path, scc_lib.FINAL)]:
+        assert path is not None
+        digest = blob_store.put_file(path)
+        blob_store.link(digest, f'{forum_dir}/{version}.pdf')
+        digests[version] = digest
+    return digests
+
+
+def get_last_valid_reference(references, reference_cache):
     for r in reversed(references):
-        status, binary = get_binary(r)
+        status, path = reference_cache.get(r)
         if status == PDFStatus.AVAILABLE:
-            return (r, binary)
+            return (r, path)
     return None, None
 
 
-def get_review_sentences_and_rating(note):
+def get_review_text_and_rating(note):
     if 'review' in note.content:
         review_text = note.content['review']
         rating = note.content['rating']
     else:
         review_text = note.content['main_review']
         rating = note.content['recommendation']
-    return [
-        sent.text
-        for sent in scc_lib.SENTENCIZE_PIPELINE(review_text).sentences
-    ], rating
+    return review_text, rating
 
 
 def write_metadata(forum_dir, forum, conference, initial_id, final_id,
-                   decision, review_notes):
+                   decision, review_notes, digests):
     reviews = []
     for review_note in review_notes:
-        review_sentences, rating = get_review_sentences_and_rating(review_note)
+        review_text, rating = get_review_text_and_rating(review_note)
         reviews.append(
-            Review(review_note.id, review_sentences, rating,
+            Review(review_note.id, review_text, None, rating,
                    export_signature(review_note),
                    review_note.tcdate)._asdict())
     with open(f'{forum_dir}/metadata.json', 'w') as f:
@@ -132,92 +228,260 @@ def write_metadata(forum_dir, forum, conference, initial_id, final_id,
                         'forum': f'{FORUM_URL_PREFIX}{forum.id}',
                         'initial': f'{PDF_URL_PREFIX}{initial_id}',
                         'final': f'{PDF_URL_PREFIX}{final_id}',
-                    }
+                    },
+                    'sha256': digests,
                 },
                 indent=2))
 
 
-def retrieve_forum(forum, conference, output_dir):
+def retrieve_forum(forum, conference, output_dir, blob_store):
+
+    # Retrieve all notes from the forum once; lookups below are in memory
+    forum_notes = crawl_lib.NoteBundle(
+        get_guest_client().get_all_notes(forum=forum.id))
 
-    # Retrieve all reviews from the forum
-    review_notes = []
-    for note in GUEST_CLIENT.get_all_notes(forum=forum.id):
-        if (note.replyto == note.forum and
-            ("main_review" in note.content or "review" in note.content)):
-            # ICLR 2022 has main_review as a field, others have review
-            review_notes.append(note)
+    # ICLR 2022 has main_review as a field, others have review
+    review_notes = [
+        note for note in forum_notes.replies_to(forum.id)
+        if "main_review" in note.content or "review" in note.content
+    ]
 
     # Retrieve decision
     decision = 'none'
-    for note in GUEST_CLIENT.get_all_notes(forum=forum.id):
-        if 'decision' in note.content.keys():
-            decision = note.content['decision']
-            break
+    for note in forum_notes.with_content('decision'):
+        decision = note.content['decision']
+        break
 
     # e.g. If the paper was withdrawn
     if not review_notes:
         return ForumStatus.NO_REVIEWS, decision
 
+    try:
+        return retrieve_revisions(forum, conference, output_dir, blob_store,
+                                  review_notes, decision), decision
+    except Exception as e:
+        raise ForumError(decision) from e
+
+
+def retrieve_revisions(forum, conference, output_dir, blob_store, review_notes,
+                       decision):
+
     # Earliest creation time out of all the reviews. Changes made before this
     # cannot have been influenced by reviewers.
     first_review_time = min(rev.tcdate for rev in review_notes)
 
     # Retrieve all revisions of the manuscript
-    references = sorted(GUEST_CLIENT.get_all_references(referent=forum.id,
-                                                        original=True),
+    references = sorted(get_guest_client().get_all_references(
+        referent=forum.id, original=True),
                         key=lambda x: x.tcdate)
 
-    # The 'final' version is the latest version associated with a valid PDF
-    final_reference, final_binary = get_last_valid_reference(references)
-
-    # The 'initial' version is the last version associated with a valid PDF
-    # that was created before the first review
-    references_before_review = [
-        r for r in references if r.tcdate <= first_review_time
-    ]
-    initial_reference, initial_binary = get_last_valid_reference(
-        references_before_review)
-
-    # Proceed only for forums with valid and distinct initial and final
-    # versions
-    if final_reference is not None and initial_reference is not None:
-        if not final_reference.id == initial_reference.id:
-
-            # Create subdirectory
-            forum_dir = f'{output_dir}/{forum.id}'
-            os.makedirs(forum_dir, exist_ok=True)
-
-            # Write pdfs and metadata
-            write_pdfs(forum_dir, initial_binary, final_binary)
-            write_metadata(forum_dir, forum, conference, initial_reference.id,
-                           final_reference.id, decision, review_notes)
-
-            return ForumStatus.COMPLETE, decision
-        else:
+    # Both walks below share one cache, so every reference is downloaded at
+    # most once. Only the two selected references are actually downloaded;
+    # unavailable ones just return an error. PDFs are streamed to a staging
+    # directory rather than kept in memory, and the ones not selected are
+    # removed with it.
+    with blob_store.staging_dir() as staging_dir:
+        reference_cache = crawl_lib.ReferenceCache(
+            lambda reference: stage_pdf(reference, staging_dir))
+
+        # The 'final' version is the latest version associated with a valid
+        # PDF
+        final_reference, final_path = get_last_valid_reference(
+            references, reference_cache)
+
+        # The 'initial' version is the last version associated with a valid
+        # PDF that was created before the first review
+        references_before_review = [
+            r for r in references if r.tcdate <= first_review_time
+        ]
+        initial_reference, initial_path = get_last_valid_reference(
+            references_before_review, reference_cache)
+
+        # Proceed only for forums with valid and distinct initial and final
+        # versions
+        if final_reference is None or initial_reference is None:
+            # No versions associated with valid PDFs were found
+            return ForumStatus.NO_PDF
+        if final_reference.id == initial_reference.id:
             # Manuscript was not revised after the first review
-            return ForumStatus.NO_REVISION, decision
-    else:
-        # No versions associated with valid PDFs were found
-        return ForumStatus.NO_PDF, decision
+            return ForumStatus.NO_REVISION
+
+        # Create subdirectory
+        forum_dir = f'{output_dir}/{forum.id}'
+        os.makedirs(forum_dir, exist_ok=True)
+
+        # Write pdfs and metadata
+        digests = write_pdfs(forum_dir, initial_path, final_path, blob_store)
+    write_metadata(forum_dir, forum, conference, initial_reference.id,
+                   final_reference.id, decision, review_notes, digests)
+
+    return ForumStatus.COMPLETE
+
+
+def widen_connection_pool(client, workers):
+    # requests keeps at most 10 connections per host by default; extra
+    # workers would otherwise open and discard a connection per request.
+    for prefix in ['https://', 'http://']:
+        adapter = client.session.get_adapter(prefix)
+        client.session.mount(
+            prefix,
+            requests.adapters.HTTPAdapter(max_retries=adapter.max_retries,
+                                          pool_connections=workers,
+                                          pool_maxsize=workers))
+
+
+def retrieve_all_forums(forums, conference, output_dir, blob_store, journal,
+                        watermarks, workers):
+    """Retrieve forums using a pool of `workers` threads.
+
+    Forums are mostly waiting on the network, so threads are enough to
+    overlap them. `forums` can be a generator that is still listing
+    submissions: only a few forums per worker are queued ahead of the pool,
+    so retrieval starts as soon as the first page arrives. Each outcome is
+    appended to `journal` as soon as it is known, along with the forum's
+    watermark if there is one.
+    """
+    if workers > 1:
+        widen_connection_pool(get_guest_client(), workers)
+    queue_slots = threading.BoundedSemaphore(2 * workers)
+    progress = tqdm.tqdm(unit='forum')
+    # Errors in the callbacks would be swallowed by the pool; they are
+    # raised again in this thread instead
+    journal_errors = []
+
+    def record_outcome(forum, future):
+        try:
+            status, decision = future.result()
+        except Exception as e:
+            # Out of retries; record it and carry on with the rest
+            tqdm.tqdm.write(f'Error in {forum.id}: {(e.__cause__ or e)!r}')
+            status = ForumStatus.ERROR
+            decision = e.decision if isinstance(e, ForumError) else 'none'
+        try:
+            journal.append({
+                'forum': forum.id,
+                'status': status,
+                'decision': decision,
+                'watermark': watermarks.get(forum.id)
+            })
+            progress.update()
+        except Exception as e:
+            journal_errors.append(e)
+        finally:
+            queue_slots.release()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for forum in forums:
+            queue_slots.acquire()
+            if journal_errors:
+                break
+            future = pool.submit(retrieve_forum, forum, conference, output_dir,
+                                 blob_store)
+            future.add_done_callback(functools.partial(record_outcome, forum))
+    progress.close()
+    if journal_errors:
+        raise journal_errors[0]
+
+
+def list_forums(conference, shard, incremental):
+    """Yield the submissions of `conference` page by page, as they are listed.
+    """
+    params = {'invitation': INVITATIONS[conference]}
+    if incremental:
+        # The replies give each forum's watermark without per-forum requests
+        params['details'] = 'replies,original'
+    for forum in crawl_lib.iter_all_notes(get_guest_client().get_notes,
+                                          **params):
+        if shard is None or crawl_lib.in_shard(forum.id, shard):
+            yield forum
+
+
+def needs_retrieval(forum, completed, watermarks):
+    record = completed.get(forum.id)
+    if record is None:
+        return True
+    # In incremental mode, completed forums are redone if anything changed
+    return (forum.id in watermarks
+            and record.get('watermark') != watermarks[forum.id])
+
+
+def merge_shards(journal_prefix, status_path, conference):
+    journals = crawl_lib.find_shard_journals(journal_prefix)
+    counts = set(shard.count for shard in journals)
+    if len(counts) != 1 or len(journals) != max(counts):
+        parser.error(f'incomplete set of shard journals: {sorted(journals)}')
+    records = {}
+    for path in journals.values():
+        records.update(crawl_lib.Journal(path).load())
+    # The API lists submissions sorted by id, so this matches the order of an
+    # unsharded run
+    crawl_lib.write_status_tsv(status_path, conference,
+                               [(forum, record['status'], record['decision'])
+                                for forum, record in sorted(records.items())])
 
 
 def main():
+    global GUEST_CLIENT, SCHEDULER
 
     args = parser.parse_args()
+    journal_prefix = f'{args.journal_file_prefix}{args.conference}'
+    status_prefix = f'{args.status_file_prefix}{args.conference}'
+    replay = args.cache_mode == crawl_lib.CachingClient.REPLAY
+    if replay:
+        # A replay redoes every forum, e.g. to try new rules for picking
+        # revisions offline, so it keeps out of the recording run's journal
+        journal_prefix += '_replay'
+        status_prefix += '_replay'
+    if args.merge_shards:
+        merge_shards(journal_prefix, f'{status_prefix}.tsv', args.conference)
+        return
+    if args.output_dir is None:
+        parser.error('--output_dir is required')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if replay and args.cache_dir is None:
+        parser.error('--cache_mode replay needs a --cache_dir')
+    SCHEDULER = crawl_lib.RequestScheduler(max_rate=args.max_rate,
+                                           max_concurrency=args.workers)
+    if args.cache_dir is not None:
+        # Outside the scheduler, so cached responses are served at once
+        GUEST_CLIENT = crawl_lib.CachingClient(get_guest_client(),
+                                               args.cache_dir, args.cache_mode)
 
     os.makedirs(args.output_dir, exist_ok=True)
-    statuses = []
-    forum_notes = GUEST_CLIENT.get_all_notes(
-        invitation=INVITATIONS[args.conference])
-    for forum in tqdm.tqdm(forum_notes):
-        status, decision = retrieve_forum(forum, args.conference,
-                                          args.output_dir)
-        statuses.append((forum.id, status, decision))
-
-    with open(f'{args.status_file_prefix}{args.conference}.tsv', 'w') as f:
-        f.write('#Conference\tForum\tStatus\tDecision\n')
-        for forum, status, decision in statuses:
-            f.write(f'{args.conference}\t{forum}\t{status}\t{decision}\n')
+    suffix = crawl_lib.shard_suffix(args.shard)
+    journal_path = f'{journal_prefix}{suffix}.jsonl'
+    os.makedirs(os.path.dirname(journal_path) or '.', exist_ok=True)
+    journal = crawl_lib.Journal(journal_path)
+    completed = {} if replay else {
+        forum: record
+        for forum, record in journal.load().items()
+        if record['status'] != ForumStatus.ERROR
+    }
+
+    listed = []
+    watermarks = {}
+
+    def pending_forums():
+        for forum in list_forums(args.conference, args.shard,
+                                 args.incremental):
+            listed.append(forum.id)
+            if args.incremental:
+                watermarks[forum.id] = crawl_lib.forum_watermark(forum)
+                forum.details = None  # only needed for the watermark
+            if needs_retrieval(forum, completed, watermarks):
+                yield forum
+
+    retrieve_all_forums(pending_forums(), args.conference, args.output_dir,
+                        scc_lib.BlobStore(args.blob_dir), journal, watermarks,
+                        args.workers)
+
+    # The status file is a view of the journal, in submission order
+    completed = journal.load()
+    crawl_lib.write_status_tsv(
+        f'{status_prefix}{suffix}.tsv', args.conference,
+        [(forum, completed[forum]['status'], completed[forum]['decision'])
+         for forum in listed])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+import collections
+import importlib
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import crawl_lib
+import scc_lib
+
+get_revisions = importlib.import_module('00_get_revisions')
+
+Forum = collections.namedtuple("Forum", "id")
+Note = collections.namedtuple("Note", "id replyto content tcdate")
+
+
+class ReferencesDownClient(object):
+
+    def get_all_notes(self, forum):
+        return [
+            Note("r", forum, {"review": "fine"}, 1),
+            Note("d", forum, {"decision": "Accept"}, 2),
+        ]
+
+    def get_all_references(self, referent, original):
+        raise RuntimeError("server down")
+
+
+class BrokenJournal(object):
+
+    def append(self, record):
+        raise OSError("disk full")
+
+
+class TestRetrieveAllForums(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.journal = crawl_lib.Journal(f'{self.temp_dir.name}/journal.jsonl')
+
+    def tearDown(self):
+        get_revisions.GUEST_CLIENT = None
+        self.temp_dir.cleanup()
+
+    def retrieve_all_forums(self, journal):
+        get_revisions.retrieve_all_forums(
+            [Forum('f'), Forum('g')], 'iclr_2020',
+            f'{self.temp_dir.name}/forums',
+            scc_lib.BlobStore(f'{self.temp_dir.name}/blobs'), journal, {}, 1)
+
+    def test_failed_forums_keep_their_decision(self):
+        get_revisions.GUEST_CLIENT = ReferencesDownClient()
+        self.retrieve_all_forums(self.journal)
+        self.assertEqual(
+            {
+                forum: (record['status'], record['decision'])
+                for forum, record in self.journal.load().items()
+            }, {
+                forum: (get_revisions.ForumStatus.ERROR, 'Accept')
+                for forum in ['f', 'g']
+            })
+
+    def test_journal_errors_reach_the_caller(self):
+
+        def retrieve_forum(forum, conference, output_dir, blob_store):
+            return get_revisions.ForumStatus.COMPLETE, 'Accept'
+
+        with mock.patch.object(get_revisions, 'retrieve_forum',
+                               retrieve_forum):
+            with self.assertRaises(OSError):
+                self.retrieve_all_forums(BrokenJournal())
+
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.retrieved = []
+
+    def tearDown(self):
+        get_revisions.GUEST_CLIENT = None
+        self.temp_dir.cleanup()
+
+    def retrieve_forum(self, forum, conference, output_dir, blob_store):
+        self.retrieved.append(forum.id)
+        return get_revisions.ForumStatus.COMPLETE, 'accept'
+
+    def run_main(self, cache_mode):
+        self.retrieved = []
+        get_revisions.GUEST_CLIENT = None
+        root = self.temp_dir.name
+        argv = [
+            '00_get_revisions.py', '-c', 'iclr_2020', '-o', f'{root}/forums',
+            '-s', f'{root}/status_', '-j', f'{root}/journal_', '-b',
+            f'{root}/blobs', '--cache_dir', f'{root}/cache', '--cache_mode',
+            cache_mode
+        ]
+        with mock.patch.object(sys, 'argv', argv), \
+                mock.patch.object(get_revisions, 'list_forums',
+                                  lambda *args: iter([Forum('f')])), \
+                mock.patch.object(get_revisions, 'retrieve_forum',
+                                  self.retrieve_forum):
+            get_revisions.main()
+        return self.retrieved
+
+    def test_replay_redoes_forums_the_recording_run_completed(self):
+        self.assertEqual(self.run_main('record'), ['f'])
+        self.assertEqual(self.run_main('record'), [])
+        self.assertEqual(self.run_main('replay'), ['f'])
+        self.assertEqual(self.run_main('replay'), ['f'])
+        # The recording run's journal is left alone
+        self.assertTrue(
+            os.path.isfile(
+                f'{self.temp_dir.name}/journal_iclr_2020_replay.jsonl'))
+        self.assertEqual(self.run_main('record'), [])
+
+
+unittest.main()
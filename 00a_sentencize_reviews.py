@@ -0,0 +1,68 @@
+import argparse
+import glob
+import json
+import tqdm
+
+import scc_lib
+
+parser = argparse.ArgumentParser(description="")
+parser.add_argument(
+    "-d",
+    "--data_dir",
+    default="forums/",
+    type=str,
+    help="Data dir",
+)
+parser.add_argument(
+    "-b",
+    "--batch_size",
+    default=1000,
+    type=int,
+    help="number of reviews passed to stanza together",
+)
+
+
+def pending_reviews(metadata):
+    # 00_get_revisions.py stores raw review text and leaves sentences empty
+    return [
+        review for review in metadata['reviews'] if review['sentences'] is None
+    ]
+
+
+def fill_in_sentences(batch):
+    """Sentencize every pending review in `batch` in one stanza call.
+
+    `batch` is a list of (filename, metadata) pairs; each metadata.json is
+    rewritten once all of its reviews are filled in.
+    """
+    reviews = sum((pending_reviews(metadata) for _, metadata in batch), [])
+    docs = scc_lib.sentencize_batch([review['text'] for review in reviews])
+    for review, doc in zip(reviews, docs):
+        review['sentences'] = [sent.text for sent in doc.sentences]
+    for filename, metadata in batch:
+        scc_lib.write_atomically(filename, json.dumps(metadata, indent=2))
+
+
+def main():
+    args = parser.parse_args()
+    batch = []
+    batch_reviews = 0
+    for filename in tqdm.tqdm(
+            sorted(glob.glob(f"{args.data_dir}/*/metadata.json"))):
+        with open(filename, 'r') as f:
+            metadata = json.load(f)
+        num_pending = len(pending_reviews(metadata))
+        if not num_pending:
+            continue
+        batch.append((filename, metadata))
+        batch_reviews += num_pending
+        if batch_reviews >= args.batch_size:
+            fill_in_sentences(batch)
+            batch = []
+            batch_reviews = 0
+    if batch:
+        fill_in_sentences(batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
 import argparse
+import concurrent.futures
 import glob
+import io
 import os
+import queue
 import tqdm
-import subprocess
 
+import clean_lib
+import extract_lib
+import pdfdiff
 import scc_lib
 
 parser = argparse.ArgumentParser(description="")
@@ -14,25 +19,208 @@ parser.add_argument(
     type=str,
     help="Data dir",
 )
+parser.add_argument(
+    "-b",
+    "--blob_dir",
+    default=None,
+    type=str,
+    help="blob store of 00_get_revisions.py, used as extraction cache; pdfs "
+    "with identical contents are only extracted once, and outputs are "
+    "replaced when the extractor changes",
+)
+parser.add_argument(
+    "-w",
+    "--workers",
+    default=1,
+    type=int,
+    help="number of pdfs to extract in parallel processes",
+)
+parser.add_argument(
+    "-p",
+    "--page_workers",
+    default=1,
+    type=int,
+    help="number of pdftotext processes per pdf; long pdfs are split into "
+    "this many page ranges",
+)
+parser.add_argument(
+    "-c",
+    "--clean",
+    action="store_true",
+    help="also clean the text as 02_clean_iclr.py does, writing <name>.txt "
+    "in the same pass; <name>_raw.txt is then only written with --keep_raw",
+)
+parser.add_argument(
+    "--keep_raw",
+    action="store_true",
+    help="with --clean, also write <name>_raw.txt",
+)
+parser.add_argument(
+    "--timeout",
+    default=300,
+    type=float,
+    help="seconds a pdf may take before it is given up on and quarantined; "
+    "0 for no limit",
+)
+parser.add_argument(
+    "--max_rss",
+    default=2048,
+    type=int,
+    help="MB of memory the extraction of a pdf may use, pdftotext included, "
+    "before it is given up on and quarantined; 0 for no limit",
+)
+parser.add_argument(
+    "-q",
+    "--quarantine_file",
+    default=None,
+    type=str,
+    help="pdfs that exceeded a limit, skipped in later runs; defaults to "
+    "<data_dir>/extract_quarantine.jsonl",
+)
+parser.add_argument(
+    "--force",
+    action="store_true",
+    help="also try quarantined pdfs again",
+)
+
+RAW_SUFFIX = "_raw.txt"
+CLEAN_SUFFIX = ".txt"
+
+
+def link_cached_text(digest, suffix, output_path, blob_store):
+    # An output linked to text of an older extractor is replaced
+    if not (os.path.isfile(output_path) and os.path.samefile(
+            output_path, blob_store.path(digest, suffix))):
+        blob_store.link(digest, output_path, suffix)
+
+
+def extract_text_with_blobs(pdf_path, blob_store, page_workers, clean,
+                            keep_raw):
+    # The text is cached next to the pdf blob and linked into the forum
+    # directory, so every copy of the same pdf reuses it. Cleaning the
+    # cached text again on every run is cheap; the cleaned text is only
+    # rewritten if it changed, so later steps can go by its mtime.
+    digest, suffix = extract_lib.cache_text(pdf_path, blob_store, page_workers)
+    if keep_raw or not clean:
+        link_cached_text(digest, suffix, f'{pdf_path[:-4]}{RAW_SUFFIX}',
+                         blob_store)
+    if clean:
+        scc_lib.write_if_changed(
+            f'{pdf_path[:-4]}{CLEAN_SUFFIX}',
+            clean_lib.clean_file(blob_store.path(digest, suffix)))
+
+
+def extract_text(pdf_path, page_workers, clean, keep_raw):
+    if not clean:
+        scc_lib.write_atomically(
+            f'{pdf_path[:-4]}{RAW_SUFFIX}',
+            extract_lib.extract_text(pdf_path, page_workers))
+        return
+    # One pass from pdftotext to the cleaned text
+    fout = io.StringIO()
+    raw_fout = io.StringIO() if keep_raw else None
+    extract_lib.extract_clean_text(pdf_path, fout, raw_fout, page_workers)
+    if keep_raw:
+        scc_lib.write_atomically(f'{pdf_path[:-4]}{RAW_SUFFIX}',
+                                 raw_fout.getvalue())
+    scc_lib.write_atomically(f'{pdf_path[:-4]}{CLEAN_SUFFIX}', fout.getvalue())
+
+
+def extract_one(pdf_path, blob_dir, page_workers, clean, keep_raw):
+    """Extract one pdf, returning an error message instead of raising.
+    """
+    try:
+        if blob_dir is not None:
+            extract_text_with_blobs(pdf_path, scc_lib.BlobStore(blob_dir),
+                                    page_workers, clean, keep_raw)
+        else:
+            extract_text(pdf_path, page_workers, clean, keep_raw)
+    except pdfdiff.ConversionError as e:
+        return str(e)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def pending_pdfs(data_dir, output_suffix=None):
+    """Pdfs to extract, largest first; with an `output_suffix`, only those
+    without that output.
 
-PLACEHOLDER = "$$$$$$$$$$$$$"
+    Starting the slowest files first keeps a long one from being the last
+    thing a pool is waiting on.
+    """
+    pdf_paths = []
+    for pdf_path in glob.glob(f"{data_dir}/*/*.pdf"):
+        if output_suffix is None or not os.path.isfile(
+                f'{pdf_path[:-4]}{output_suffix}'):
+            pdf_paths.append(pdf_path)
+    return sorted(pdf_paths, key=os.path.getsize, reverse=True)
 
 
-def extract_text(pdf_path):
-    output = subprocess.run(["python", "pdfdiff.py", pdf_path],
-                            capture_output=True).stdout
-    return (output.decode().replace("-\n", "").replace(
-        "\n\n", PLACEHOLDER).replace("\n", " ").replace(PLACEHOLDER, "\n\n"))
+def extract_limited(workers, pdf_path, options):
+    """Extract one pdf in a free worker of the queue `workers`, returning
+    (error, exceeded).
+    """
+    worker = workers.get()
+    try:
+        return worker.call(extract_one, pdf_path, *options), False
+    except scc_lib.LimitExceeded as e:
+        return str(e), True
+    finally:
+        workers.put(worker)
 
 
 def main():
     args = parser.parse_args()
-    for pdf_path in tqdm.tqdm(list(glob.glob(f"{args.data_dir}/*/*.pdf"))):
-        if not os.path.isfile(f'{pdf_path[:-4]}_raw.txt'):
-            text = extract_text(pdf_path)
-            output_path = f'{pdf_path[:-4]}_raw.txt'
-            with open(output_path, 'w') as f:
-                f.write(text)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.page_workers < 1:
+        parser.error("--page_workers must be at least 1")
+    quarantine = scc_lib.Quarantine(
+        args.quarantine_file or f"{args.data_dir}/extract_quarantine.jsonl")
+    if args.blob_dir is not None:
+        # With a cache every pdf is checked, as its text may be out of date
+        pdf_paths = pending_pdfs(args.data_dir)
+    else:
+        pdf_paths = pending_pdfs(args.data_dir,
+                                 CLEAN_SUFFIX if args.clean else RAW_SUFFIX)
+    if not args.force:
+        quarantined = {p for p in pdf_paths if quarantine.reason(p)}
+        if quarantined:
+            print(f"Skipping {len(quarantined)} quarantined pdfs; rerun with "
+                  "--force to try them again")
+            pdf_paths = [p for p in pdf_paths if p not in quarantined]
+    options = (args.blob_dir, args.page_workers, args.clean, args.keep_raw)
+    # Every pdf is extracted in a worker process that is killed, and
+    # replaced, when the pdf takes too long or uses too much memory
+    workers = queue.Queue()
+    for _ in range(args.workers):
+        worker = scc_lib.LimitedWorker(timeout=args.timeout or None,
+                                       max_rss=args.max_rss << 20 or None)
+        worker.start()
+        workers.put(worker)
+    failures = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(args.workers) as pool:
+            futures = {
+                pool.submit(extract_limited, workers, pdf_path, options):
+                pdf_path
+                for pdf_path in pdf_paths
+            }
+            for future in tqdm.tqdm(concurrent.futures.as_completed(futures),
+                                    total=len(futures)):
+                error, exceeded = future.result()
+                if exceeded:
+                    quarantine.add(futures[future], error)
+                if error is not None:
+                    failures[futures[future]] = error
+    finally:
+        while not workers.empty():
+            workers.get().close()
+    for pdf_path, error in sorted(failures.items()):
+        print(f"Error: {pdf_path}: {error}")
+    print(f"Extracted {len(pdf_paths) - len(failures)} of {len(pdf_paths)} "
+          "pdfs")
 
 
 if __name__ == "__main__":
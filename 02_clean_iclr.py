@@ -1,10 +1,14 @@
 import argparse
+import concurrent.futures
 import glob
 import json
+import os
 import sys
-import re
 import tqdm
 
+import clean_lib
+import scc_lib
+
 parser = argparse.ArgumentParser(description="")
 parser.add_argument(
     "-d",
@@ -13,69 +17,72 @@ parser.add_argument(
     type=str,
     help="Data dir",
 )
+parser.add_argument(
+    "-w",
+    "--workers",
+    default=1,
+    type=int,
+    help="number of files to clean in parallel processes",
+)
+parser.add_argument(
+    "--force",
+    action="store_true",
+    help="clean every file, ignoring the manifest of earlier runs",
+)
 
-UNDER_REVIEW_RE = re.compile(
-    "Under review as a conference paper at ICLR 20[0-9]{2}")
-PUBLISHED_RE = re.compile("Published as a conference paper at ICLR 20[0-9]{2}")
-ABSTRACT_HEADER_RE = re.compile("^A\sBSTRACT")
-SECTION_HEADER_RE = re.compile("^[A-Z]\s?[A-Z+]")
-
-
-def mostly_caps(line):
-    letters = "".join(line.split())
-    return len([x for x in letters if x.isupper()]) / len(letters) > 0.8
-
-
-def clean_file(filename):
+RAW_SUFFIX = "_raw.txt"
+CLEAN_SUFFIX = ".txt"
+# Sidecar in the data dir with what every raw file was cleaned from
+MANIFEST = "clean_manifest.json"
 
-    with open(filename, 'r') as f:
-        lines = [line.strip() for line in f.readlines()]
 
-    curr_page_num = 0
-    final_lines = []
+def clean_one(task):
+    raw_path, record = task
+    output_path = f'{raw_path[:-len(RAW_SUFFIX)]}{CLEAN_SUFFIX}'
+    return raw_path, clean_lib.clean_if_changed(raw_path, output_path, record)
 
-    abstract_seen = False
-    for i in range(len(lines)):
-        line = lines[i]
-        if not line:
-            continue
-        if line.startswith("R EFERENCES"):
-            # References starting. We are done.
-            break
-        if UNDER_REVIEW_RE.match(line) or PUBLISHED_RE.match(line):
-            if i > 2:
-                #assert not lines[i-1]
-                next_page_num = str(curr_page_num + 1)
-                curr_page_num += 1
-                temp = final_lines.pop(-1)
-                if temp.endswith(next_page_num):
-                    final_lines.append(temp[:-len(next_page_num)])
-                else:
-                    final_lines.append(temp)
-                continue
-        #elif ABSTRACT_HEADER_RE.match(line):
-        #    abstract_seen = True
-        #    final_lines.append(line)
-        #elif abstract_seen and SECTION_HEADER_RE.match(line):
-        #    print("*", final_lines[-1])
-        #    if mostly_caps(line) and final_lines[-1][-1].isnumeric():
-        #        prev_line = final_lines.pop(-1)
-        #        rev_sec_num = re.search("^([0-9](\s\.[0-9]+)*)",
-        #        prev_line[::-1]).group(1)
-        #        final_lines.append(
-        #            prev_line[:-len(rev_sec_num)])
-        #    final_lines.append(line)
-        else:
-            final_lines.append(line)
 
-    return "\n".join(final_lines)
+def load_manifest(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
 
 
 def main():
     args = parser.parse_args()
-    for filename in tqdm.tqdm(list(glob.glob(f'{args.data_dir}/*/*_raw.txt'))):
-        with open(filename.replace("_raw", ""), 'w') as f:
-            f.write(clean_file(filename))
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    manifest_path = os.path.join(args.data_dir, MANIFEST)
+    manifest = {} if args.force else load_manifest(manifest_path)
+    raw_paths = sorted(glob.glob(f'{args.data_dir}/*/*{RAW_SUFFIX}'))
+    # Keyed relative to the data dir, however that is spelled
+    keys = {
+        raw_path: os.path.relpath(raw_path, args.data_dir)
+        for raw_path in raw_paths
+    }
+    tasks = [(raw_path, manifest.get(keys[raw_path]))
+             for raw_path in raw_paths]
+    updated = 0
+    pool = None
+    try:
+        if args.workers == 1:
+            results = map(clean_one, tasks)
+        else:
+            pool = concurrent.futures.ProcessPoolExecutor(args.workers)
+            results = pool.map(clean_one, tasks, chunksize=64)
+        for raw_path, record in tqdm.tqdm(results, total=len(tasks)):
+            if record is not None:
+                manifest[keys[raw_path]] = record
+                updated += 1
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        # Kept even when interrupted, so finished files are not redone
+        if updated:
+            scc_lib.write_atomically(manifest_path,
+                                     json.dumps(manifest, indent=2))
+    print(f"Updated {updated} of {len(raw_paths)} files")
 
 
 if __name__ == "__main__":
@@ -20,7 +20,7 @@ def get_tokens(filename):
     with open(filename, 'r') as f:
         text = f.read()
         return list([t.to_dict()[0]['text'] for t in s.tokens]
-                    for s in scc_lib.SENTENCIZE_PIPELINE(text).sentences)
+                    for s in scc_lib.get_sentencize_pipeline()(text).sentences)
 
 
 def main():
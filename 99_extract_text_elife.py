@@ -1,8 +1,10 @@
 import argparse
+import functools
 import glob
 from tqdm import tqdm
-import subprocess
 
+import extract_lib
+import pdfdiff
 import scc_lib
 
 from google.cloud import bigquery
@@ -18,21 +20,48 @@ parser.add_argument(
     type=str,
     help="Data dir",
 )
-
-PLACEHOLDER = "$$$$$$$$$$$$$"
+parser.add_argument(
+    "--timeout",
+    default=300,
+    type=float,
+    help="seconds a pdf may take before it is given up on and quarantined; "
+    "0 for no limit",
+)
+parser.add_argument(
+    "--max_rss",
+    default=2048,
+    type=int,
+    help="MB of memory the extraction of a pdf may use before it is given up "
+    "on and quarantined; 0 for no limit",
+)
+parser.add_argument(
+    "--force",
+    action="store_true",
+    help="also try quarantined pdfs again",
+)
 
 # ------------------------------------------------------------------------
 # eLife via GoogleStorage
 # ------------------------------------------------------------------------
 
-# Instantiates client
-GOOGLE_STORAGE = storage.Client()
-
 # The name for the new bucket
 BUCKET_NAME = "mimir-elife-pdfs"
 
-# Link to the bucket
-bucket = GOOGLE_STORAGE.bucket(BUCKET_NAME)
+
+@functools.lru_cache(maxsize=None)
+def get_storage_client():
+    """
+    Instantiates client on first use, not at import
+    """
+    return storage.Client()
+
+
+@functools.lru_cache(maxsize=None)
+def get_bucket():
+    """
+    Link to the bucket
+    """
+    return get_storage_client().bucket(BUCKET_NAME)
 
 
 def return_paths(blob_list):
@@ -88,7 +117,7 @@ def get_storage_paths():
         stage = prefix.split("_")[0]
 
         # get blob objects corresponding to MSes at each stage
-        blob_list = GOOGLE_STORAGE.list_blobs(BUCKET_NAME, prefix=prefix)
+        blob_list = get_storage_client().list_blobs(BUCKET_NAME, prefix=prefix)
 
         # get their relative Storage paths
         paths = return_paths(blob_list)
@@ -131,43 +160,57 @@ def make_local_dir(data_dir, ms_id):
 # ------------------------------------------------------------------------
 
 
-def extract_text(pdf_path):
-    output = subprocess.run(["python", "pdfdiff.py", pdf_path],
-                            capture_output=True).stdout
-    return (output.decode().replace("-\n", "").replace(
-        "\n\n", PLACEHOLDER).replace("\n", " ").replace(PLACEHOLDER, "\n\n"))
-
-
 def main():
     args = parser.parse_args()
 
     # get all dct of ms_id and its storage paths
     storage_paths_dct = get_storage_paths()
 
-    for ms_id, paths_dct in tqdm(storage_paths_dct.items()):
-
-        # make local dir and get local pdf_path
-        local_dir = make_local_dir(args.data_dir, ms_id)
-
-        for stage, storage_path in paths_dct.items():
-
-            cleaned_stage = stage.split("_")[0]
-
-            # summon blob object
-            blob = bucket.blob(storage_path)
-
-            # hack to move blob data to local dir
-            pdf_path = local_dir + f"{ms_id}_{cleaned_stage}"
-
-            with blob.open("rb") as raw_blob:
-                with open(f"{pdf_path}.pdf", "wb") as temp:
-                    temp.write(raw_blob.read())
-
-            text = extract_text(pdf_path)
-            # os.remove(f"{pdf_path}.pdf")
-            output_path = f"{pdf_path}.txt"
-            with open(output_path, "w") as f:
-                f.write(text)
+    # pdfs that were too slow or too large are skipped in later runs
+    quarantine = scc_lib.Quarantine(
+        f"{args.data_dir}/extract_quarantine.jsonl")
+    with scc_lib.LimitedWorker(timeout=args.timeout or None,
+                               max_rss=args.max_rss << 20 or None) as worker:
+        for ms_id, paths_dct in tqdm(storage_paths_dct.items()):
+
+            # make local dir and get local pdf_path
+            local_dir = make_local_dir(args.data_dir, ms_id)
+
+            for stage, storage_path in paths_dct.items():
+
+                cleaned_stage = stage.split("_")[0]
+
+                # summon blob object
+                blob = get_bucket().blob(storage_path)
+
+                # hack to move blob data to local dir
+                pdf_path = local_dir + f"{ms_id}_{cleaned_stage}"
+
+                with blob.open("rb") as raw_blob:
+                    with open(f"{pdf_path}.pdf", "wb") as temp:
+                        temp.write(raw_blob.read())
+
+                if (not args.force
+                        and quarantine.reason(f"{pdf_path}.pdf") is not None):
+                    continue
+                try:
+                    text = worker.call(extract_lib.extract_text,
+                                       f"{pdf_path}.pdf")
+                except scc_lib.LimitExceeded as e:
+                    print(f"Error: {pdf_path}.pdf: {e}")
+                    quarantine.add(f"{pdf_path}.pdf", str(e))
+                    continue
+                except pdfdiff.ConversionError as e:
+                    print(f"Error: {pdf_path}.pdf: {e}")
+                    continue
+                except Exception as e:
+                    # One bad pdf should not end the run
+                    print(f"Error: {pdf_path}.pdf: {type(e).__name__}: {e}")
+                    continue
+                # os.remove(f"{pdf_path}.pdf")
+                output_path = f"{pdf_path}.txt"
+                with open(output_path, "w") as f:
+                    f.write(text)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,274 @@
+"""Time pdfdiff normalization and text extraction on synthetic input.
+
+The inputs are generated locally: pdftotext-style text of several shapes,
+and small pdfs of the same text. Throughput and peak memory of every stage
+go to a JSON file, so that runs on the same machine can be compared across
+commits.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import benchmark_normalize
+import extract_lib
+import pdfdiff
+
+parser = argparse.ArgumentParser(description="")
+parser.add_argument(
+    "-n",
+    "--num_lines",
+    default=100000,
+    type=int,
+    help="number of lines of synthetic pdftotext output per input",
+)
+parser.add_argument(
+    "--pdf_pages",
+    default=20,
+    type=int,
+    help="number of pages of the synthetic pdfs",
+)
+parser.add_argument(
+    "-r",
+    "--repeat",
+    default=3,
+    type=int,
+    help="runs per stage; the fastest is reported",
+)
+parser.add_argument(
+    "--seed",
+    default=0,
+    type=int,
+    help="random seed for the synthetic text",
+)
+parser.add_argument(
+    "-o",
+    "--output",
+    default="benchmark_results/extract.json",
+    type=str,
+    help="JSON file the results are written to",
+)
+parser.add_argument(
+    "--compare",
+    default=None,
+    type=str,
+    help="JSON file of an earlier run to compare throughput with; may be "
+    "the --output file",
+)
+
+LINES_PER_PAGE = 60
+
+# Keyword arguments of synthetic_document for every kind of input
+INPUTS = {
+    "typical": {},
+    "long_paragraphs": {
+        "width": 100,
+        "paragraph_probability": 0.01
+    },
+    "formulas_and_ligatures": {
+        "odd_probability": 0.4
+    },
+    "sparse_pages": {
+        "sparse_fraction": 0.6
+    },
+}
+
+
+def synthetic_document(num_lines, seed=0, sparse_fraction=0.0, **options):
+    """Pages of synthetic pdftotext output of about `num_lines` lines in
+    all, ending in a page number.
+
+    A `sparse_fraction` of the pages only have a few short lines between
+    blank ones, as pages of figures and tables do. Other `options` go to
+    benchmark_normalize.synthetic_text.
+    """
+    rng = random.Random(seed)
+    lines = benchmark_normalize.synthetic_text(num_lines, seed,
+                                               **options).splitlines()
+    pages = []
+    for start in range(0, len(lines), LINES_PER_PAGE):
+        page = lines[start:start + LINES_PER_PAGE]
+        if rng.random() < sparse_fraction:
+            kept = sorted(rng.sample(range(len(page)), min(len(page), 8)))
+            page = sum(([page[i][:rng.randint(10, 40)], ""] for i in kept), [])
+        pages.append(page + ["", str(len(pages) + 1), ""])
+    return pages
+
+
+def pdf_string(line):
+    # Helvetica in a pdf without embedded fonts only has latin-1 glyphs
+    line = line.encode("latin-1", "replace").decode("latin-1")
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(pages, path):
+    """Write a minimal pdf with the lines of every page of `pages`."""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica "
+        "/Encoding /WinAnsiEncoding >>",
+    ]
+    kids = []
+    for page in pages:
+        content = "BT /F1 8 Tf 10 TL 40 800 Td\n" + "".join(
+            f"({pdf_string(line)}) '\n" for line in page) + "ET"
+        objects.append(f"<< /Length {len(content.encode('latin-1'))} >>\n"
+                       f"stream\n{content}\nendstream")
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       "/Resources << /Font << /F1 3 0 R >> >> "
+                       f"/Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = (f"<< /Type /Pages /Kids [{' '.join(kids)}] "
+                  f"/Count {len(kids)} >>")
+    pdf = io.BytesIO()
+    pdf.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(pdf.tell())
+        pdf.write(f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1"))
+    xref = pdf.tell()
+    pdf.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        pdf.write(f"{offset:010d} 00000 n \n".encode())
+    pdf.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+              f"startxref\n{xref}\n%%EOF\n".encode())
+    with open(path, "wb") as f:
+        f.write(pdf.getvalue())
+
+
+def measure(function, repeat):
+    """Fastest time of `repeat` calls of `function`, and the peak of Python
+    memory allocated during a further call, in bytes.
+
+    Memory is traced in a separate call as tracing slows everything down.
+    Memory used by pdftotext is not included.
+    """
+    seconds = min(time_call(function) for _ in range(max(1, repeat)))
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def time_call(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def stages(text, text_path, pdf_path):
+    """Map from stage name to (function, input size in bytes)."""
+
+    def normalize_text():
+        pdfdiff.normalize_text(io.StringIO(text), io.StringIO())
+
+    text_size = len(text.encode())
+    stage_functions = {
+        "normalize_text": (normalize_text, text_size),
+        "normalize_anything":
+        (lambda: pdfdiff.normalize_anything(text_path, io.StringIO()),
+         text_size),
+        "extract_text":
+        (lambda: extract_lib.extract_text(text_path), text_size),
+    }
+    if pdfdiff.is_command_available(pdfdiff.pdftotextProgram):
+        stage_functions["extract_text_pdf"] = (
+            lambda: extract_lib.extract_text(pdf_path),
+            os.path.getsize(pdf_path))
+    return stage_functions
+
+
+def run_benchmarks(args, temp_dir):
+    results = []
+    for name, options in INPUTS.items():
+        pages = synthetic_document(args.num_lines, args.seed, **options)
+        text = "".join(line + "\n" for page in pages for line in page)
+        text_path = os.path.join(temp_dir, f"{name}.txt")
+        with open(text_path, "w") as f:
+            f.write(text)
+        pdf_pages = pages[:args.pdf_pages]
+        pdf_path = os.path.join(temp_dir, f"{name}.pdf")
+        write_pdf(pdf_pages, pdf_path)
+        for stage, (function, size) in stages(text, text_path,
+                                              pdf_path).items():
+            if stage.endswith("_pdf"):
+                num_lines = sum(len(page) for page in pdf_pages)
+            else:
+                num_lines = text.count("\n")
+            seconds, peak = measure(function, args.repeat)
+            results.append({
+                "stage": stage,
+                "input": name,
+                "lines": num_lines,
+                "bytes": size,
+                "seconds": seconds,
+                "lines_per_second": num_lines / seconds,
+                "mb_per_second": size / 1e6 / seconds,
+                "peak_memory_mb": peak / 1e6,
+            })
+            print(f"{stage:<20} {name:<24} {num_lines / seconds:>12,.0f} "
+                  f"lines/s {size / 1e6 / seconds:>8.2f} MB/s "
+                  f"{peak / 1e6:>8.1f} MB peak")
+    if not pdfdiff.is_command_available(pdfdiff.pdftotextProgram):
+        print("pdftotext not found, pdfs were not extracted")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, earlier_results):
+    earlier = {(r["stage"], r["input"]): r for r in earlier_results}
+    for result in results:
+        before = earlier.get((result["stage"], result["input"]))
+        if before is not None:
+            print(f"{result['stage']:<20} {result['input']:<24} "
+                  f"{result['mb_per_second'] / before['mb_per_second']:.2f}x "
+                  "the throughput before")
+
+
+def main():
+    args = parser.parse_args()
+    # Read first, as it may be the file this run is written to
+    earlier_results = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            earlier_results = json.load(f)["results"]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results = run_benchmarks(args, temp_dir)
+    run = {
+        "commit": git_commit(),
+        "time": time.time(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "options": vars(args),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(run, f, indent=2)
+    if earlier_results is not None:
+        compare(results, earlier_results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Check and time pdfdiff.normalize_text against the original algorithm.
+
+The original per-character normalizer is kept here, unchanged, as the
+reference. The two differ on purpose in one respect: pdfdiff replaces every
+Latin ligature with its letters, and the original did not. So the output of
+the reference is compared after its ligatures are replaced too.
+"""
+import argparse
+import io
+import random
+import string
+import time
+
+import pdfdiff
+
+parser = argparse.ArgumentParser(description="")
+parser.add_argument(
+    "-n",
+    "--num_lines",
+    default=200000,
+    type=int,
+    help="number of lines of synthetic pdftotext output",
+)
+parser.add_argument(
+    "--seed",
+    default=0,
+    type=int,
+    help="random seed for the synthetic text",
+)
+
+WORDS = (
+    "we propose a model for learning representations of the data and "
+    "show that it improves over strong baselines on several benchmark "
+    "tasks while using fewer parameters than previous approaches").split()
+ODD_WORDS = [
+    "e.g.", "i.e.,", "et al.", "Fig. 3", "Section 4.2", "J. Smith", "(2019)",
+    "[12]", "x_1", "$\\theta$", "θ", "∑", "—", "eﬃcient", "diﬀerent", "baﬄe",
+    "efﬁcient", "(see", "above)", "state-of-the-art"
+]
+
+# == The original normalizer ================================================
+# Copied unchanged from pdfdiff.py as it was before the normalizer was
+# rewritten, except that the literals in fix_ff_problem are written as
+# escapes: pdfdiff.py is read as latin-1, so these are the strings it
+# actually replaced.
+
+longSentenceLength = pdfdiff.longSentenceLength
+sentenceBuf = ""
+lastWordLength = 0
+
+
+def fix_ff_problem(sentence):
+    """
+    Hack to fix an often occurring latex problem with 'ff' combinations.
+    This is ultimately a font problem (with Times New Roman), and not our
+    problem (probably latex, alternatively pdftotext ought to fix it).
+    For now, we just stupidly revert the weird character combos.
+    """
+    sentence = sentence.replace("\u00ef\u00ac\x83", "ffi")
+    sentence = sentence.replace("\u00ef\u00ac\x84", "ffl")
+    sentence = sentence.replace("\u00ef\u00ac\x80", "ff")
+    return sentence
+
+
+def is_sentence_end(c):
+    """
+    The following characters are considered to be sentence endings for our
+    normalization.
+    """
+    return c in ".!?"
+
+
+def is_sentence_break(c):
+    """
+    The following characters are considered to be sentence breaks for our
+    normalization of long sentences.
+    """
+    return c in string.punctuation
+
+
+def is_sentence_done(sentence):
+    """
+    Detect whether the sentence is done
+    """
+    global longSentenceLength
+
+    if len(sentence) > 0:
+        if is_sentence_end(sentence[-1]):
+            return True
+        else:
+            if len(sentence) >= longSentenceLength:
+                if is_sentence_break(sentence[-1]):
+                    return True
+    return False
+
+
+def flush_sentence(fout, forceNewLine=False):
+    """
+    Flush the sentence buffer.
+    """
+    global sentenceBuf
+    global lastWordLength
+
+    lastWordLength = 0
+    l = sentenceBuf.lstrip()
+    l = fix_ff_problem(l)
+    fout.write(l)
+    if forceNewLine or (sentenceBuf != ""):
+        fout.write("\n")
+    sentenceBuf = ""
+
+
+def reference_normalize_text(fin, fout):
+    """
+    Normalize the lines read from fin, and output to fout, which
+    are file handles.
+    """
+    global sentenceBuf
+    global lastWordLength
+
+    sentenceBuf = ""  # stores unfinished sentences
+    wordLength = 0
+    lastWordLength = 0
+    skipEnds = False
+
+    # Alternatively, we could use xreadlines, if the files are really
+    # really huge.
+    for l in fin.readlines():
+        # Cut of spacing from both ends
+        ls = l.strip()
+
+        # Empty line or not?
+        if ls == "":
+            # This occurs when there is an empty line.
+            # We flush the sentence, and force a newline.
+            #
+            # Any further additional empty lines have no effect,
+            # which is enforced by skipEnds.
+            if not skipEnds:
+                flush_sentence(fout)
+                flush_sentence(fout, True)
+                skipEnds = True
+        else:
+            # The file line is not empty, so this is some sort of
+            # paragraph
+            skipEnds = False
+            if sentenceBuf != "":
+                if not sentenceBuf[-1] in string.whitespace:
+                    sentenceBuf += " "
+
+            for c in ls:
+                # Append the character to the current buffer.
+                sentenceBuf += c
+
+                # Some admin to know how long the last word was.
+                if c in string.ascii_letters:
+                    wordLength += 1
+                    lastWordLength = wordLength
+                else:
+                    wordLength = 0
+
+                if is_sentence_done(sentenceBuf):
+                    # If the last word is only a single character,
+                    # it's assumed that the punctuation does not
+                    # refer to a sentence end.
+                    if lastWordLength != 1:
+                        # Sentence has ended, so flush it.
+                        # We should skip any spacing directly after
+                        # the sentence end mark.
+                        flush_sentence(fout)
+
+    flush_sentence(fout)
+    fout.flush()
+
+
+# == Synthetic input =========================================================
+
+
+def synthetic_text(num_lines,
+                   seed=0,
+                   width=80,
+                   paragraph_probability=0.15,
+                   odd_probability=0.1):
+    """Text shaped like pdftotext output: paragraphs of sentences wrapped at
+    `width`, with hyphenation, abbreviations, initials, formulas and
+    ligatures.
+
+    A paragraph ends after a sentence with `paragraph_probability`, and a
+    word is one of ODD_WORDS with `odd_probability`.
+    """
+    rng = random.Random(seed)
+    lines = []
+    line = ""
+    while len(lines) < num_lines:
+        words = [
+            rng.choice(ODD_WORDS if rng.random() < odd_probability else WORDS)
+            for _ in range(rng.randint(8, 30))
+        ]
+        for i in rng.sample(range(len(words)), len(words) // 10):
+            words[i] += rng.choice(",;:")
+        words[0] = words[0].capitalize()
+        words[-1] += rng.choice("...?!")
+        for word in words:
+            if len(line) + len(word) >= width:
+                if rng.random() < 0.1 and len(word) > 5:
+                    lines.append(f"{line}{word[:3]}-")
+                    word = word[3:]
+                else:
+                    lines.append(line.rstrip())
+                line = ""
+            line += word + " "
+        if rng.random() < paragraph_probability:
+            lines.extend([line.rstrip(), ""])
+            line = ""
+    return "\n".join(lines[:num_lines]) + "\n"
+
+
+def normalize(normalizer, text):
+    fout = io.StringIO()
+    normalizer(io.StringIO(text), fout)
+    return fout.getvalue()
+
+
+def time_normalizer(normalizer, text):
+    start = time.perf_counter()
+    output = normalize(normalizer, text)
+    return output, time.perf_counter() - start
+
+
+def main():
+    args = parser.parse_args()
+    text = synthetic_text(args.num_lines, args.seed)
+    expected, reference_time = time_normalizer(reference_normalize_text, text)
+    output, time_taken = time_normalizer(pdfdiff.normalize_text, text)
+    # The original left most ligatures alone
+    if output != pdfdiff.fix_ff_problem(expected):
+        raise SystemExit("Output differs from the reference normalizer")
+    megabytes = len(text.encode()) / 1e6
+    print(f"Same output as the reference, apart from ligatures, on "
+          f"{args.num_lines} lines ({megabytes:.1f} MB)")
+    print(f"reference: {reference_time:.2f}s "
+          f"({megabytes / reference_time:.2f} MB/s)")
+    print(f"pdfdiff:   {time_taken:.2f}s ({megabytes / time_taken:.2f} MB/s), "
+          f"{reference_time / time_taken:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
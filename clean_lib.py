@@ -0,0 +1,116 @@
+import functools
+import hashlib
+import os
+import re
+
+import scc_lib
+
+UNDER_REVIEW_RE = re.compile(
+    "Under review as a conference paper at ICLR 20[0-9]{2}")
+PUBLISHED_RE = re.compile("Published as a conference paper at ICLR 20[0-9]{2}")
+ABSTRACT_HEADER_RE = re.compile("^A\sBSTRACT")
+SECTION_HEADER_RE = re.compile("^[A-Z]\s?[A-Z+]")
+
+
+def mostly_caps(line):
+    letters = "".join(line.split())
+    return len([x for x in letters if x.isupper()]) / len(letters) > 0.8
+
+
+def clean_lines(lines):
+    """Yield the lines of an extracted ICLR paper without page headers, page
+    numbers, empty lines and anything from the references on.
+
+    The last kept line is held back until the next one, as a page header
+    following it means its page number has to be cut off.
+    """
+    curr_page_num = 0
+    last_line = None
+
+    abstract_seen = False
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("R EFERENCES"):
+            # References starting. We are done.
+            break
+        if UNDER_REVIEW_RE.match(line) or PUBLISHED_RE.match(line):
+            if i > 2:
+                next_page_num = str(curr_page_num + 1)
+                curr_page_num += 1
+                if last_line is not None and last_line.endswith(next_page_num):
+                    last_line = last_line[:-len(next_page_num)]
+                continue
+        #elif ABSTRACT_HEADER_RE.match(line):
+        #    abstract_seen = True
+        #    final_lines.append(line)
+        #elif abstract_seen and SECTION_HEADER_RE.match(line):
+        #    print("*", final_lines[-1])
+        #    if mostly_caps(line) and final_lines[-1][-1].isnumeric():
+        #        prev_line = final_lines.pop(-1)
+        #        rev_sec_num = re.search("^([0-9](\s\.[0-9]+)*)",
+        #        prev_line[::-1]).group(1)
+        #        final_lines.append(
+        #            prev_line[:-len(rev_sec_num)])
+        #    final_lines.append(line)
+        else:
+            if last_line is not None:
+                yield last_line
+            last_line = line
+
+    if last_line is not None:
+        yield last_line
+
+
+def clean_file(filename):
+    with open(filename, 'r') as f:
+        return "\n".join(clean_lines(f))
+
+
+@functools.lru_cache(maxsize=None)
+def cleaner_version():
+    """Digest of the source of this module, so that a change to any of the
+    cleaning rules marks every output as out of date.
+    """
+    with open(__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def file_state(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def clean_if_changed(raw_path, output_path, record=None):
+    """Clean `raw_path` into `output_path` unless that is already done.
+
+    `record` is what this returned when `raw_path` was last cleaned. If
+    neither file changed since, by size and mtime, and neither did the
+    cleaner, nothing is read. A raw file that was only touched is hashed
+    and not cleaned again, and an output whose text is unchanged is not
+    rewritten.
+
+    Returns the record to keep for the next call, or None if it is
+    unchanged.
+    """
+    version = cleaner_version()
+    raw_state = file_state(raw_path)
+    output_state = (file_state(output_path)
+                    if os.path.isfile(output_path) else None)
+    if (record is not None and record['cleaner'] == version
+            and output_state is not None and record['output'] == output_state):
+        if record['raw'] == raw_state:
+            return None
+        raw_sha256 = scc_lib.file_sha256(raw_path)
+        if record['raw_sha256'] == raw_sha256:
+            return dict(record, raw=raw_state)
+    else:
+        raw_sha256 = scc_lib.file_sha256(raw_path)
+    scc_lib.write_if_changed(output_path, clean_file(raw_path))
+    return {
+        'raw': raw_state,
+        'raw_sha256': raw_sha256,
+        'output': file_state(output_path),
+        'cleaner': version,
+    }
@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+import clean_lib
+
+RAW_TEXT = """Under review as a conference paper at ICLR 2020
+
+A sentence ending on page one. 1
+Under review as a conference paper at ICLR 2020
+Text on page two.
+R EFERENCES
+A reference.
+"""
+
+
+class TestCleanIfChanged(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.raw_path = os.path.join(self.temp_dir.name, 'initial_raw.txt')
+        self.output_path = os.path.join(self.temp_dir.name, 'initial.txt')
+        with open(self.raw_path, 'w') as f:
+            f.write(RAW_TEXT)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_only_changed_files_are_cleaned(self):
+        record = clean_lib.clean_if_changed(self.raw_path, self.output_path)
+        with open(self.output_path) as f:
+            self.assertEqual(
+                f.read(), "A sentence ending on page one. \n"
+                "Text on page two.")
+        self.assertIsNone(
+            clean_lib.clean_if_changed(self.raw_path, self.output_path,
+                                       record))
+        # Touched, but with the same contents
+        os.utime(self.raw_path, ns=(0, 0))
+        touched = clean_lib.clean_if_changed(self.raw_path, self.output_path,
+                                             record)
+        self.assertEqual(touched['output'], record['output'])
+        with open(self.raw_path, 'a') as f:
+            f.write("More references.\n")
+        self.assertNotEqual(
+            clean_lib.clean_if_changed(self.raw_path, self.output_path,
+                                       touched)['raw_sha256'],
+            record['raw_sha256'])
+
+
+unittest.main()
@@ -0,0 +1,535 @@
+import argparse
+import collections
+import glob
+import hashlib
+import json
+import openreview
+import os
+import random
+import re
+import requests
+import tempfile
+import threading
+import time
+
+import scc_lib
+
+PDF_CHUNK_SIZE = 1 << 16
+
+
+class NoteBundle(object):
+    """All notes of a forum, fetched once and indexed in memory.
+
+    Lookups preserve the order in which the API returned the notes.
+    """
+
+    def __init__(self, notes):
+        self.notes = list(notes)
+        self._by_replyto = collections.defaultdict(list)
+        self._by_content_key = collections.defaultdict(list)
+        for i, note in enumerate(self.notes):
+            self._by_replyto[note.replyto].append(i)
+            for key in note.content:
+                self._by_content_key[key].append(i)
+
+    def _lookup(self, index, keys):
+        positions = set()
+        for key in keys:
+            positions.update(index.get(key, []))
+        return [self.notes[i] for i in sorted(positions)]
+
+    def replies_to(self, note_id):
+        return self._lookup(self._by_replyto, [note_id])
+
+    def with_content(self, *keys):
+        """Notes whose content has at least one of `keys`."""
+        return self._lookup(self._by_content_key, keys)
+
+
+class ReferenceCache(object):
+    """Remembers the PDF status and contents of each reference of a forum.
+
+    `fetch` maps a reference note to a (status, pdf) pair. It is called at
+    most once per reference id, so walking overlapping reference lists does
+    not download the same revision twice.
+    """
+
+    def __init__(self, fetch):
+        self._fetch = fetch
+        self._results = {}
+
+    def get(self, reference):
+        if reference.id not in self._results:
+            self._results[reference.id] = self._fetch(reference)
+        return self._results[reference.id]
+
+
+class Journal(scc_lib.Journal):
+    """Append-only log of per-forum crawl outcomes, one JSON record per line.
+    """
+
+    def __init__(self, path):
+        super().__init__(path, key='forum')
+
+
+def write_status_tsv(path, conference, statuses):
+    with open(path, 'w') as f:
+        f.write('#Conference\tForum\tStatus\tDecision\n')
+        for forum, status, decision in statuses:
+            f.write(f'{conference}\t{forum}\t{status}\t{decision}\n')
+
+
+def iter_all_notes(get_notes, page_size=1000, **params):
+    """Like get_all_notes, but yields notes as each page arrives.
+
+    `get_notes` fetches a single page, e.g. client.get_notes. Pages are
+    requested in id order, each continuing after the last id seen, until one
+    comes back empty, as in openreview.tools.efficient_iterget. A short page
+    does not end the listing: the server may return fewer than `page_size`.
+    """
+    after = None
+    while True:
+        page = get_notes(limit=page_size, sort='id', after=after, **params)
+        if not page:
+            return
+        yield from page
+        after = page[-1].id
+
+
+def forum_watermark(forum):
+    """Latest modification time (tmdate) seen anywhere in a forum.
+
+    Needs a submission note listed with details='replies,original'. Every
+    new or edited reply shows up in the replies, and every new revision of
+    the paper updates the tmdate of the original submission, so this moves
+    whenever anything in the forum changes.
+    """
+    details = forum.details or {}
+    tmdates = [forum.tmdate]
+    if details.get('original'):
+        tmdates.append(details['original']['tmdate'])
+    tmdates += [reply['tmdate'] for reply in details.get('replies', [])]
+    return max(tmdates)
+
+
+# == Sharding ================================================================
+
+Shard = collections.namedtuple("Shard", "index count")
+
+SHARD_SUFFIX_RE = re.compile(r"\.shard_([0-9]+)_of_([0-9]+)\.jsonl$")
+
+
+def parse_shard(spec):
+    """argparse type for shards given as i/N, with 0 <= i < N."""
+    try:
+        index, count = [int(part) for part in spec.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got '{spec}'")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"expected 0 <= i < N, got '{spec}'")
+    return Shard(index, count)
+
+
+def in_shard(forum_id, shard):
+    # hash() is salted per process, so it would not agree across machines
+    digest = hashlib.sha1(forum_id.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % shard.count == shard.index
+
+
+def shard_suffix(shard):
+    return "" if shard is None else f".shard_{shard.index}_of_{shard.count}"
+
+
+def find_shard_journals(journal_prefix):
+    """Map from Shard to the path of its journal."""
+    journals = {}
+    for path in glob.glob(f"{journal_prefix}.shard_*_of_*.jsonl"):
+        match = SHARD_SUFFIX_RE.search(path)
+        if match:
+            journals[Shard(int(match.group(1)), int(match.group(2)))] = path
+    return journals
+
+
+class CacheMiss(KeyError):
+    pass
+
+
+class CachingClient(object):
+    """Wraps a ScheduledClient and keeps its responses on disk.
+
+    Covers the calls made by the crawler: get_notes, get_all_notes,
+    get_all_references and download_pdf. In RECORD mode, stored
+    responses are served from disk and everything else is fetched from
+    `client` and stored. In REPLAY mode the network is never used, and a
+    request that was not recorded raises CacheMiss. Other attributes are
+    passed through to `client`.
+    """
+    RECORD = "record"
+    REPLAY = "replay"
+    MODES = [RECORD, REPLAY]
+
+    # Errors that will not go away on retry, so they can be replayed too
+    PERMANENT_ERRORS = ["ForbiddenError", "NotFoundError"]
+
+    def __init__(self, client, cache_dir, mode=RECORD):
+        assert mode in self.MODES
+        self._client = client
+        self.cache_dir = cache_dir
+        self.mode = mode
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _path(self, method, params, suffix):
+        key = hashlib.sha1(
+            json.dumps([method, params], sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.cache_dir, method, key[:2], f'{key}{suffix}')
+
+    def _store(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        scc_lib.write_atomically(path, data)
+
+    def _check_replay(self, method, params):
+        if self.mode == self.REPLAY:
+            raise CacheMiss(f'{method} {params} was not recorded')
+
+    def _get_all(self, method, params):
+        path = self._path(method, params, '.json')
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                return [openreview.Note.from_json(n) for n in json.load(f)]
+        self._check_replay(method, params)
+        notes = getattr(self._client, method)(**params)
+        # to_json leaves out details, which from_json does read back
+        self._store(
+            path,
+            json.dumps([
+                dict(note.to_json(), details=note.details) for note in notes
+            ]))
+        return notes
+
+    def get_notes(self, **params):
+        return self._get_all('get_notes', params)
+
+    def get_all_notes(self, **params):
+        return self._get_all('get_all_notes', params)
+
+    def get_all_references(self, **params):
+        return self._get_all('get_all_references', params)
+
+    def _pdf_path(self, id, is_reference):
+        # Path of the recorded pdf, which may not exist yet
+        params = {'id': id, 'is_reference': is_reference}
+        path = self._path('get_pdf', params, '.pdf')
+        if os.path.isfile(path):
+            return path
+        error_path = self._path('get_pdf', params, '.error.json')
+        if os.path.isfile(error_path):
+            with open(error_path, 'r') as f:
+                raise openreview.OpenReviewException(json.load(f))
+        self._check_replay('get_pdf', params)
+        return path
+
+    def _read_pdf(self, path, chunk_size):
+        with open(path, 'rb') as f:
+            yield from iter(lambda: f.read(chunk_size), b'')
+
+    def _record_pdf(self, chunks, path):
+        # Record the pdf while passing it on, without holding it in memory
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                         prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            scc_lib.replace_with_temp_file(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _store_permanent_error(self, e, id, is_reference):
+        if error_details(e).get('name') in self.PERMANENT_ERRORS:
+            params = {'id': id, 'is_reference': is_reference}
+            self._store(self._path('get_pdf', params, '.error.json'),
+                        json.dumps(e.args[0]))
+
+    def download_pdf(self,
+                     consume,
+                     id,
+                     is_reference=False,
+                     chunk_size=PDF_CHUNK_SIZE):
+        """Like ScheduledClient.download_pdf, recording the pdf on the way.
+
+        Pdfs that were not recorded are downloaded by the wrapped client.
+        """
+        path = self._pdf_path(id, is_reference)
+        if os.path.isfile(path):
+            return consume(self._read_pdf(path, chunk_size))
+        try:
+            return self._client.download_pdf(
+                lambda chunks: consume(self._record_pdf(chunks, path)),
+                id,
+                is_reference=is_reference,
+                chunk_size=chunk_size)
+        except openreview.OpenReviewException as e:
+            self._store_permanent_error(e, id, is_reference)
+            raise
+
+
+def get_error(response):
+    # Same error format as openreview.Client, which keeps its version private
+    if 'application/json' in response.headers.get('Content-Type', ''):
+        return response.json()
+    return {'name': 'Error', 'message': response.text or response.reason}
+
+
+def iter_pdf(client, id, is_reference=False, chunk_size=PDF_CHUNK_SIZE):
+    """Like client.get_pdf, but yields the pdf in chunks as it downloads.
+
+    Raises openreview.OpenReviewException on HTTP errors, like get_pdf.
+    """
+    headers = client.headers.copy()
+    headers['content-type'] = 'application/pdf'
+    url = client.pdf_revisions_url if is_reference else client.pdf_url
+    with client.session.get(url,
+                            params={'id': id},
+                            headers=headers,
+                            stream=True) as response:
+        if not response.ok:
+            raise openreview.OpenReviewException(get_error(response))
+        yield from response.iter_content(chunk_size)
+
+
+# == Request scheduling ======================================================
+
+
+class ErrorClass(object):
+    THROTTLED = "throttled"  # the server asked us to slow down
+    TRANSIENT = "transient"  # worth retrying
+    PERMANENT = "permanent"  # retrying will not help
+
+
+RetryPolicy = collections.namedtuple("RetryPolicy",
+                                     "max_attempts base_delay max_delay")
+
+RETRY_POLICIES = {
+    ErrorClass.THROTTLED: RetryPolicy(10, 5.0, 300.0),
+    ErrorClass.TRANSIENT: RetryPolicy(5, 1.0, 60.0),
+    ErrorClass.PERMANENT: RetryPolicy(1, 0.0, 0.0),
+}
+
+
+def error_details(e):
+    """The error dict of an openreview.OpenReviewException, or {} if it
+    carries something else, e.g. a plain message.
+    """
+    return e.args[0] if e.args and isinstance(e.args[0], dict) else {}
+
+
+def classify_error(e):
+    if isinstance(e, openreview.OpenReviewException):
+        error = error_details(e)
+        if error.get('status') == 429 or error.get('name') == 'RateLimitError':
+            return ErrorClass.THROTTLED
+        if error.get('name') in CachingClient.PERMANENT_ERRORS:
+            return ErrorClass.PERMANENT
+        return ErrorClass.TRANSIENT
+    if isinstance(e, requests.RequestException):
+        # Includes downloads that break off partway, e.g. ChunkedEncodingError
+        status = getattr(e.response, 'status_code', None)
+        if status == 429:
+            return ErrorClass.THROTTLED
+        if status is not None and 400 <= status < 500:
+            return ErrorClass.PERMANENT
+        return ErrorClass.TRANSIENT
+    return ErrorClass.PERMANENT
+
+
+class RequestScheduler(object):
+    """Runs API calls under a rate limit, with retries and adaptive
+    concurrency.
+
+    Calls first take a token from a bucket refilled at `rate` per second and
+    wait for one of `concurrency` slots. Failures are retried according to
+    the RetryPolicy of their ErrorClass, with exponential backoff and jitter.
+    Both the rate and the concurrency adapt: they are halved whenever the
+    server throttles us, concurrency shrinks while latency is well above the
+    best seen recently, and both creep back up to their maximum on success.
+    """
+
+    # Latency (relative to the lowest seen) above which we back off
+    LATENCY_TOLERANCE = 4.0
+    # Growth of the lowest latency per call, so that it follows the server
+    # when it gets slower for good
+    MIN_LATENCY_DECAY = 1.01
+
+    def __init__(self,
+                 max_rate=5.0,
+                 max_concurrency=1,
+                 retry_policies=RETRY_POLICIES,
+                 sleep=time.sleep,
+                 clock=time.monotonic):
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.retry_policies = retry_policies
+        self._sleep = sleep
+        self._clock = clock
+
+        self.rate = max_rate
+        self.concurrency = float(max_concurrency)
+        self._tokens = max(1.0, max_rate)
+        self._last_refill = clock()
+        self._in_flight = 0
+        self._latency = None
+        self._min_latency = None
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+
+    def _take_token(self):
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(
+                    max(1.0, self.rate),
+                    self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+    def _take_slot(self):
+        with self._slot_freed:
+            while self._in_flight >= int(self.concurrency):
+                self._slot_freed.wait()
+            self._in_flight += 1
+
+    def _free_slot(self):
+        with self._slot_freed:
+            self._in_flight -= 1
+            self._slot_freed.notify_all()
+
+    def _on_success(self, latency):
+        with self._lock:
+            if self._latency is None:
+                self._latency = self._min_latency = latency
+            self._latency = 0.8 * self._latency + 0.2 * latency
+            self._min_latency = min(self._min_latency * self.MIN_LATENCY_DECAY,
+                                    latency)
+            if self._latency > self.LATENCY_TOLERANCE * self._min_latency:
+                self.concurrency = max(1.0, self.concurrency * 0.9)
+            else:
+                self.concurrency = min(float(self.max_concurrency),
+                                       self.concurrency + 1 / self.concurrency)
+            self.rate = min(self.max_rate, self.rate + 0.05 * self.max_rate)
+
+    def _on_throttled(self):
+        with self._lock:
+            self.concurrency = max(1.0, self.concurrency / 2)
+            self.rate = max(0.05 * self.max_rate, self.rate / 2)
+
+    def _backoff(self, policy, attempt):
+        delay = min(policy.max_delay, policy.base_delay * 2**attempt)
+        self._sleep(random.uniform(delay / 2, delay))
+
+    def call(self, fn, *args, **kwargs):
+        return self._call(lambda: fn(*args, **kwargs), lambda: None)
+
+    def call_streaming(self, consume, fn, *args, **kwargs):
+        """Returns consume(fn(*args, **kwargs)) for a `fn` that yields its
+        response in chunks, e.g. to store a download as it arrives.
+
+        The whole download is retried, calling `consume` again, but only the
+        time to the first chunk counts as the latency of the request: the
+        rest depends on the size of the response, not on the server.
+        """
+        first_chunk_time = []
+
+        def timed_chunks():
+            for chunk in fn(*args, **kwargs):
+                if not first_chunk_time:
+                    first_chunk_time.append(self._clock())
+                yield chunk
+
+        def attempt():
+            first_chunk_time.clear()
+            return consume(timed_chunks())
+
+        return self._call(
+            attempt, lambda: first_chunk_time[0] if first_chunk_time else None)
+
+    def _call(self, attempt_call, response_time):
+        # `response_time` gives the time the response started arriving, or
+        # None to take the time the call returned
+        attempt = 0
+        while True:
+            self._take_token()
+            self._take_slot()
+            start = self._clock()
+            try:
+                result = attempt_call()
+            except Exception as e:
+                error_class = classify_error(e)
+                if error_class == ErrorClass.THROTTLED:
+                    self._on_throttled()
+                policy = self.retry_policies[error_class]
+                attempt += 1
+                if attempt >= policy.max_attempts:
+                    raise
+            else:
+                end = response_time()
+                if end is None:
+                    end = self._clock()
+                self._on_success(end - start)
+                return result
+            finally:
+                self._free_slot()
+            self._backoff(policy, attempt - 1)
+
+
+class ScheduledClient(object):
+    """Wraps an openreview.Client so that its requests run under a
+    RequestScheduler.
+
+    Covers the calls made by the crawler: get_notes, get_all_notes,
+    get_all_references and download_pdf. Wrapped in a CachingClient, only
+    the requests that miss the cache are scheduled. Other attributes are
+    passed through to `client`.
+    """
+
+    def __init__(self, client, scheduler):
+        self._client = client
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def get_notes(self, **params):
+        return self.scheduler.call(self._client.get_notes, **params)
+
+    def get_all_notes(self, **params):
+        return self.scheduler.call(self._client.get_all_notes, **params)
+
+    def get_all_references(self, **params):
+        return self.scheduler.call(self._client.get_all_references, **params)
+
+    def download_pdf(self,
+                     consume,
+                     id,
+                     is_reference=False,
+                     chunk_size=PDF_CHUNK_SIZE):
+        """Returns consume(chunks of the pdf), e.g. to store it as it
+        downloads.
+
+        `consume` is called again with a fresh download when the download is
+        retried, so it should start over each time.
+        """
+        return self.scheduler.call_streaming(consume,
+                                             iter_pdf,
+                                             self._client,
+                                             id,
+                                             is_reference=is_reference,
+                                             chunk_size=chunk_size)
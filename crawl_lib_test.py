@@ -0,0 +1,365 @@
+import argparse
+import collections
+import openreview
+import os
+import requests
+import tempfile
+import unittest
+
+import crawl_lib
+
+Note = collections.namedtuple("Note", "id forum replyto invitation content")
+
+FORUM_NOTES = [
+    Note("f", "f", None, "Blind_Submission", {"title": "t"}),
+    Note("r1", "f", "f", "Official_Review", {
+        "review": "a",
+        "rating": "6"
+    }),
+    Note("c1", "f", "r1", "Official_Comment", {"comment": "b"}),
+    Note("d", "f", "f", "Decision", {"decision": "Accept"}),
+    Note("r2", "f", "f", "Official_Review", {"main_review": "c"}),
+]
+
+
+class TestNoteBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.bundle = crawl_lib.NoteBundle(FORUM_NOTES)
+
+    def test_replies_to(self):
+        self.assertEqual([n.id for n in self.bundle.replies_to("f")],
+                         ["r1", "d", "r2"])
+        self.assertEqual(self.bundle.replies_to("missing"), [])
+
+    def test_with_content_keeps_api_order(self):
+        reviews = self.bundle.with_content("main_review", "review")
+        self.assertEqual([n.id for n in reviews], ["r1", "r2"])
+
+
+class TestReferenceCache(unittest.TestCase):
+
+    def test_fetches_each_reference_once(self):
+        fetched = []
+
+        def fetch(reference):
+            fetched.append(reference.id)
+            return "available", reference.id.encode()
+
+        cache = crawl_lib.ReferenceCache(fetch)
+        for note in FORUM_NOTES + FORUM_NOTES[:2]:
+            self.assertEqual(cache.get(note), ("available", note.id.encode()))
+        self.assertEqual(fetched, [note.id for note in FORUM_NOTES])
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'journal.jsonl')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_latest_record_wins(self):
+        journal = crawl_lib.Journal(self.path)
+        journal.append({'forum': 'a', 'status': 'no_pdf'})
+        journal.append({'forum': 'b', 'status': 'complete'})
+        journal.append({'forum': 'a', 'status': 'complete'})
+        self.assertEqual(
+            crawl_lib.Journal(self.path).load(), {
+                'a': {
+                    'forum': 'a',
+                    'status': 'complete'
+                },
+                'b': {
+                    'forum': 'b',
+                    'status': 'complete'
+                },
+            })
+
+    def test_torn_last_line_is_dropped(self):
+        crawl_lib.Journal(self.path).append({'forum': 'a', 'status': 'x'})
+        with open(self.path, 'a') as f:
+            f.write('{"forum": "b", "sta')
+        journal = crawl_lib.Journal(self.path)
+        journal.append({'forum': 'c', 'status': 'y'})
+        self.assertEqual(sorted(journal.load()), ['a', 'c'])
+
+
+class FakePdfResponse(object):
+
+    def __init__(self, id):
+        self.ok = id != "forbidden"
+        self.headers = {"Content-Type": "application/json"}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def json(self):
+        return {"name": "ForbiddenError"}
+
+    def iter_content(self, chunk_size):
+        yield from [b"%PDF", b"-1.4"]
+
+
+class FakeClient(object):
+    headers = {}
+    pdf_url = "pdf"
+    pdf_revisions_url = "pdf/revisions"
+
+    def __init__(self):
+        self.calls = 0
+        # Pdfs are downloaded through the session, as by openreview.Client
+        self.session = self
+
+    def get_all_notes(self, forum=None):
+        self.calls += 1
+        return [
+            openreview.Note("Official_Review", [], [], ["Reviewer1"],
+                            {"review": "fine"},
+                            id="r1",
+                            forum=forum,
+                            replyto=forum,
+                            tcdate=1)
+        ]
+
+    def get(self, url, params, headers, stream):
+        self.calls += 1
+        return FakePdfResponse(params["id"])
+
+
+class TestCachingClient(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.client = FakeClient()
+        self.scheduler = CountingScheduler()
+        self.recorder = crawl_lib.CachingClient(
+            crawl_lib.ScheduledClient(self.client, self.scheduler),
+            self.temp_dir.name)
+        self.replayer = crawl_lib.CachingClient(None, self.temp_dir.name,
+                                                crawl_lib.CachingClient.REPLAY)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_replays_recorded_notes(self):
+        recorded = self.recorder.get_all_notes(forum="f")
+        self.recorder.get_all_notes(forum="f")
+        self.assertEqual(self.client.calls, 1)
+        (replayed, ) = self.replayer.get_all_notes(forum="f")
+        self.assertEqual(replayed.to_json(), recorded[0].to_json())
+        with self.assertRaises(crawl_lib.CacheMiss):
+            self.replayer.get_all_notes(forum="g")
+
+    def test_replays_pdfs_and_permanent_errors(self):
+        for client in [self.recorder, self.replayer]:
+            self.assertEqual(
+                client.download_pdf(b"".join, "ok", is_reference=True),
+                b"%PDF-1.4")
+            with self.assertRaises(openreview.OpenReviewException) as error:
+                client.download_pdf(b"".join, "forbidden", is_reference=True)
+            self.assertEqual(error.exception.args[0]["name"], "ForbiddenError")
+        self.assertEqual(self.client.calls, 2)
+
+    def test_only_cache_misses_are_scheduled(self):
+        for _ in range(2):
+            self.recorder.get_all_notes(forum="f")
+            self.assertEqual(
+                self.recorder.download_pdf(b"".join, "ok", is_reference=True),
+                b"%PDF-1.4")
+        self.assertEqual(self.scheduler.calls, 2)
+        self.assertEqual(self.client.calls, 2)
+
+
+class CountingScheduler(crawl_lib.RequestScheduler):
+
+    def __init__(self):
+        super().__init__(max_rate=1000.0)
+        self.calls = 0
+
+    def _call(self, attempt_call, response_time):
+        self.calls += 1
+        return super()._call(attempt_call, response_time)
+
+
+class TestRequestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.sleeps = []
+        self.scheduler = crawl_lib.RequestScheduler(max_rate=100.0,
+                                                    max_concurrency=8,
+                                                    sleep=self.sleep,
+                                                    clock=lambda: self.now)
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def flaky(self, errors):
+        errors = list(errors)
+
+        def call():
+            if errors:
+                raise errors.pop(0)
+            return "ok"
+
+        return call
+
+    def test_transient_errors_are_retried_with_backoff(self):
+        call = self.flaky([
+            openreview.OpenReviewException({"name": "Error"}),
+            crawl_lib.requests.ConnectionError(),
+        ])
+        self.assertEqual(self.scheduler.call(call), "ok")
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertLess(self.sleeps[0], self.sleeps[1])
+
+    def test_permanent_errors_are_not_retried(self):
+        call = self.flaky(
+            [openreview.OpenReviewException({"name": "NotFoundError"})])
+        with self.assertRaises(openreview.OpenReviewException):
+            self.scheduler.call(call)
+        self.assertEqual(self.sleeps, [])
+
+    def test_throttling_halves_rate_and_concurrency(self):
+        call = self.flaky([
+            openreview.OpenReviewException({
+                "name": "RateLimitError",
+                "status": 429
+            })
+        ])
+        self.assertEqual(self.scheduler.call(call), "ok")
+        self.assertLess(self.scheduler.rate, 100.0)
+        self.assertLess(self.scheduler.concurrency, 8)
+
+    def test_downloads_and_fast_calls_keep_concurrency_up(self):
+        scheduler = crawl_lib.RequestScheduler(max_rate=1000.0,
+                                               max_concurrency=16,
+                                               sleep=self.sleep,
+                                               clock=lambda: self.now)
+
+        def request(latency):
+            self.now += latency
+
+        def download(first_byte, body):
+            self.now += first_byte
+            yield b"%PDF"
+            self.now += body
+            yield b"-1.4"
+
+        # Instant responses at first, e.g. from a local cache, then a crawl
+        # of forums with fast API calls and slow pdf downloads
+        for _ in range(20):
+            scheduler.call(request, 0.001)
+        for forum in range(200):
+            scheduler.call(request, 0.1)
+            scheduler.call(request, 0.3)
+            for body in [1.0, 3.0]:
+                scheduler.call_streaming(b"".join, download, 0.1, body)
+        self.assertGreater(scheduler.concurrency, 8)
+
+    def test_errors_without_details_are_transient(self):
+        error = openreview.OpenReviewException("Bad Gateway")
+        self.assertEqual(crawl_lib.error_details(error), {})
+        self.assertEqual(crawl_lib.classify_error(error),
+                         crawl_lib.ErrorClass.TRANSIENT)
+
+    def test_failed_requests_are_transient_unless_client_errors(self):
+        for error in [
+                requests.exceptions.ChunkedEncodingError(),
+                requests.exceptions.ContentDecodingError(),
+                requests.exceptions.RetryError(),
+                requests.ConnectionError(),
+        ]:
+            self.assertEqual(crawl_lib.classify_error(error),
+                             crawl_lib.ErrorClass.TRANSIENT)
+        for status, error_class in [(404, crawl_lib.ErrorClass.PERMANENT),
+                                    (429, crawl_lib.ErrorClass.THROTTLED),
+                                    (503, crawl_lib.ErrorClass.TRANSIENT)]:
+            response = requests.Response()
+            response.status_code = status
+            self.assertEqual(
+                crawl_lib.classify_error(
+                    requests.HTTPError(response=response)), error_class)
+        self.assertEqual(crawl_lib.classify_error(ValueError()),
+                         crawl_lib.ErrorClass.PERMANENT)
+
+    def test_rate_limit_spaces_out_calls(self):
+        scheduler = crawl_lib.RequestScheduler(max_rate=2.0,
+                                               sleep=self.sleep,
+                                               clock=lambda: self.now)
+        for _ in range(6):
+            scheduler.call(lambda: None)
+        self.assertAlmostEqual(self.now, 2.0)
+
+
+class TestIterAllNotes(unittest.TestCase):
+
+    def setUp(self):
+        self.requested = []
+        self.cap = 1000
+
+    def get_notes(self, limit, sort, after, invitation):
+        self.requested.append(after)
+        notes = [n for n in FORUM_NOTES if after is None or n.id > after]
+        return sorted(notes, key=lambda n: n.id)[:min(limit, self.cap)]
+
+    def test_pages_are_yielded_as_they_arrive(self):
+        notes = crawl_lib.iter_all_notes(self.get_notes,
+                                         page_size=2,
+                                         invitation="")
+        self.assertEqual(next(notes).id, "c1")
+        self.assertEqual(self.requested, [None])
+        self.assertEqual([n.id for n in notes], ["d", "f", "r1", "r2"])
+        self.assertEqual(self.requested, [None, "d", "r1", "r2"])
+
+    def test_pages_shorter_than_asked_for_do_not_end_the_listing(self):
+        self.cap = 2
+        notes = crawl_lib.iter_all_notes(self.get_notes,
+                                         page_size=1000,
+                                         invitation="")
+        self.assertEqual([n.id for n in notes], ["c1", "d", "f", "r1", "r2"])
+
+
+class TestForumWatermark(unittest.TestCase):
+
+    def test_latest_tmdate_in_forum(self):
+        forum = openreview.Note("Blind_Submission", [], [], [], {},
+                                id="f",
+                                tmdate=5,
+                                details={
+                                    "original": {
+                                        "tmdate": 7
+                                    },
+                                    "replies": [{
+                                        "tmdate": 6
+                                    }, {
+                                        "tmdate": 9
+                                    }]
+                                })
+        self.assertEqual(crawl_lib.forum_watermark(forum), 9)
+        forum.details = None
+        self.assertEqual(crawl_lib.forum_watermark(forum), 5)
+
+
+class TestShards(unittest.TestCase):
+
+    def test_every_forum_is_in_exactly_one_shard(self):
+        shards = [crawl_lib.parse_shard(f"{i}/3") for i in range(3)]
+        for forum_id in ["HkxLXnAcFQ", "B1e3OlStPB", "rJxycxHKDS", "f"]:
+            self.assertEqual([crawl_lib.in_shard(forum_id, s)
+                              for s in shards].count(True), 1)
+
+    def test_parse_shard_rejects_bad_specs(self):
+        for spec in ["3/3", "1", "a/b", "-1/2"]:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                crawl_lib.parse_shard(spec)
+
+
+unittest.main()
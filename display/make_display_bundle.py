@@ -1,4 +1,5 @@
 import argparse
+import functools
 import glob
 import json
 import os
@@ -46,8 +47,10 @@ def main_to_background(tag):
     return tag.replace('diff', 'bg')
 
 
-with open('templates/template.html', 'r') as f:
-    TEMPLATE_TEXT = f.read()
+@functools.lru_cache(maxsize=None)
+def get_template_text():
+    with open('templates/template.html', 'r') as f:
+        return f.read()
 
 
 def get_all_tokens(diff):
@@ -190,7 +193,7 @@ def build_core_bundle(diff_dir, data_dir, output_dir):
 
         diff_text = " ".join([before, diff_tokens, after])
         diff_identifier = f'{forum}|||{diff_index}'
-        html_text = str(TEMPLATE_TEXT).replace(
+        html_text = get_template_text().replace(
             "DIFF_IDENTIFIER", diff_identifier).replace(
                 "DIFF_TEXT",
                 diff_text).replace("PREV_INDEX", str(diff_index - 1)).replace(
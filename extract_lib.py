@@ -0,0 +1,180 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+
+import clean_lib
+import pdfdiff
+import scc_lib
+
+# Bump when a change to pdfdiff or to this module changes the extracted
+# text, so that text cached by earlier versions is not used any more.
+EXTRACTOR_VERSION = 3
+
+# Pdfs are only split into page ranges of at least this many pages; for
+# shorter ranges starting pdftotext costs more than it saves.
+MIN_RANGE_PAGES = 8
+
+
+def page_ranges(num_pages, num_ranges, min_pages=MIN_RANGE_PAGES):
+    """Split pages 1 to `num_pages` into at most `num_ranges` contiguous
+    (first, last) ranges of about equal size.
+    """
+    num_ranges = max(1, min(num_ranges, num_pages // min_pages))
+    size, larger = divmod(num_pages, num_ranges)
+    ranges = []
+    first = 1
+    for i in range(num_ranges):
+        last = first + size - 1 + (i < larger)
+        ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+
+def pdf_lines(pdf_path, page_workers):
+    """Yield the pdftotext lines of `pdf_path`, converting page ranges with up
+    to `page_workers` pdftotext processes at once.
+
+    pdftotext writes every page on its own, so the ranges put together in
+    order are the output of a single run; a sentence cut at a range
+    boundary is joined up again by the normalizer reading them.
+    """
+    if not pdfdiff.is_command_available(pdfdiff.pdfinfoProgram):
+        yield from pdfdiff.pdf_to_text(pdf_path)
+        return
+    ranges = page_ranges(pdfdiff.pdf_page_count(pdf_path), page_workers)
+    if len(ranges) == 1:
+        yield from pdfdiff.pdf_to_text(pdf_path)
+        return
+    with concurrent.futures.ThreadPoolExecutor(len(ranges)) as pool:
+        futures = [
+            pool.submit(lambda r: list(pdfdiff.pdf_to_text(pdf_path, *r)),
+                        page_range) for page_range in ranges
+        ]
+        for future in futures:
+            yield from future.result()
+
+
+def text_lines(pdf_path, page_workers=1):
+    """Yield the lines of text of `pdf_path` (or of a ps or text file).
+
+    With more than one page worker, long pdfs are converted in page ranges
+    in parallel, with the same result.
+    """
+    if page_workers > 1 and pdfdiff.get_filetype(pdf_path) == "pdf":
+        return pdf_lines(pdf_path, page_workers)
+    return pdfdiff.text_lines(pdf_path)
+
+
+def joined_lines(normalized_lines):
+    """Yield the lines of the text made of the normalized lines, each taken
+    to end in a newline, with hyphenation and line breaks undone and only
+    paragraph breaks kept. The text is never put together as a whole.
+    """
+    line = []
+    newlines = 0
+    for normalized in normalized_lines:
+        # A hyphen at the end of a line joins it to the next
+        hyphenated = normalized.endswith("-")
+        text = normalized[:-1] if hyphenated else normalized
+        if text and newlines:
+            # Every pair of newlines is a paragraph break, and a single
+            # one left over is a space.
+            if newlines > 1:
+                yield "".join(line)
+                for _ in range(newlines // 2 * 2 - 1):
+                    yield ""
+                line = []
+            if newlines % 2:
+                line.append(" ")
+            newlines = 0
+        line.append(text)
+        if not hyphenated:
+            newlines += 1
+    if newlines > 1:
+        yield "".join(line)
+        for _ in range(newlines // 2 * 2 - 1):
+            yield ""
+        line = []
+    if newlines % 2:
+        line.append(" ")
+    yield "".join(line)
+
+
+def raw_lines(pdf_path, page_workers=1):
+    """Yield the lines of the extracted text of `pdf_path`, which is
+    normalized, de-hyphenated and joined into paragraphs as it streams in.
+    """
+    return joined_lines(pdfdiff.Normalizer().normalize(
+        text_lines(pdf_path, page_workers)))
+
+
+def extract_text(pdf_path, page_workers=1):
+    return "\n".join(raw_lines(pdf_path, page_workers))
+
+
+def write_lines(lines, fout):
+    for i, line in enumerate(lines):
+        if i:
+            fout.write("\n")
+        fout.write(line)
+
+
+def tee_lines(lines, fout):
+    """Yield from `lines`, writing them to `fout` on the way."""
+    for i, line in enumerate(lines):
+        if i:
+            fout.write("\n")
+        fout.write(line)
+        yield line
+
+
+def extract_clean_text(pdf_path, fout, raw_fout=None, page_workers=1):
+    """Write the cleaned text of the ICLR paper `pdf_path` to `fout`, in one
+    pass from pdftotext through normalizing, joining and cleaning.
+
+    The result is what 01_extract_text.py and then 02_clean_iclr.py write.
+    The raw text in between is only written if `raw_fout` is given.
+    """
+    lines = raw_lines(pdf_path, page_workers)
+    if raw_fout is not None:
+        lines = tee_lines(lines, raw_fout)
+    write_lines(clean_lib.clean_lines(lines), fout)
+    if raw_fout is not None:
+        # Cleaning stops at the references, the raw text does not
+        for _ in lines:
+            pass
+    else:
+        lines.close()
+
+
+def cache_suffix():
+    """Suffix of extracted text cached in a scc_lib.BlobStore.
+
+    It names the extractor version and the options that change the text, so
+    text from other versions or options is never served; cached text
+    stored under other suffixes is left alone.
+    """
+    options = json.dumps(
+        {
+            "pdftotext_options": pdfdiff.pdftotextOptions,
+            "long_sentence_length": pdfdiff.longSentenceLength,
+        },
+        sort_keys=True)
+    options_digest = hashlib.sha256(options.encode()).hexdigest()[:12]
+    return f"_text_v{EXTRACTOR_VERSION}_{options_digest}.txt"
+
+
+def cache_text(pdf_path, blob_store, page_workers=1):
+    """Make sure the text of `pdf_path` is cached in `blob_store`.
+
+    The text is keyed by the SHA-256 of the pdf and by cache_suffix(), and
+    is only extracted if no pdf with the same bytes was extracted before.
+    Returns the (digest, suffix) the text is stored under.
+    """
+    digest = scc_lib.file_sha256(pdf_path)
+    suffix = cache_suffix()
+    if not os.path.isfile(blob_store.path(digest, suffix)):
+        blob_store.put_derived(digest, suffix,
+                               extract_text(pdf_path, page_workers))
+    return digest, suffix
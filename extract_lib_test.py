@@ -0,0 +1,166 @@
+import io
+import os
+import random
+import tempfile
+import unittest
+
+import clean_lib
+import extract_lib
+import pdfdiff
+import scc_lib
+
+# Fakes of pdfinfo and pdftotext for a 20 page pdf, whose sentences run on
+# from one page to the next.
+FAKE_PDFINFO = """#!/bin/sh
+echo "Title: paper"
+echo "Pages: 20"
+"""
+FAKE_PDFTOTEXT = """#!/bin/sh
+first=1
+last=20
+while [ "$#" -gt 2 ]; do
+    case "$1" in
+        -f) first=$2; shift 2;;
+        -l) last=$2; shift 2;;
+        *) shift;;
+    esac
+done
+i=$first
+while [ $i -le $last ]; do
+    echo "ends on page $i. A sentence that starts on page $i and"
+    i=$((i + 1))
+done
+"""
+
+
+def join_lines(normalized_text):
+    # How the normalized text used to be joined, on the text as a whole
+    placeholder = "$$$$$$$$$$$$$"
+    return (normalized_text.replace("-\n", "").replace(
+        "\n\n", placeholder).replace("\n", " ").replace(placeholder, "\n\n"))
+
+
+class TestJoinedLines(unittest.TestCase):
+
+    def test_keeps_paragraph_breaks_only(self):
+        self.assertEqual(
+            "\n".join(
+                extract_lib.joined_lines(
+                    ["A hyphen-", "ated line", "wraps.", "", "Next."])),
+            "A hyphenated line wraps.\n\nNext. ")
+
+    def test_same_as_joining_the_whole_text(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            lines = [
+                rng.choice(["", "-", "a", "b-", "c d"])
+                for _ in range(rng.randint(0, 10))
+            ]
+            self.assertEqual("\n".join(extract_lib.joined_lines(lines)),
+                             join_lines("".join(l + "\n" for l in lines)))
+
+
+class TestExtractCleanText(unittest.TestCase):
+
+    def test_same_as_extracting_then_cleaning(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pdf_path = os.path.join(temp_dir, "final.pdf")
+            with open(pdf_path, "w") as f:
+                f.write("Our paper\nis about this.\n\nIt ends on page\n"
+                        "one. 1\n\nUnder review as a conference paper at "
+                        "ICLR 2019\n\nMore on page two.\n\n"
+                        "R EFERENCES\n\nSomeone. A paper.\n")
+            raw = extract_lib.extract_text(pdf_path)
+            raw_path = os.path.join(temp_dir, "final_raw.txt")
+            with open(raw_path, "w") as f:
+                f.write(raw)
+            fout = io.StringIO()
+            raw_fout = io.StringIO()
+            extract_lib.extract_clean_text(pdf_path, fout, raw_fout)
+            self.assertEqual(fout.getvalue(), clean_lib.clean_file(raw_path))
+        self.assertEqual(raw_fout.getvalue(), raw)
+        self.assertEqual(
+            fout.getvalue(), "Our paper is about this.\n"
+            "It ends on page one. \nMore on page two.")
+
+
+class TestPageRanges(unittest.TestCase):
+
+    def test_ranges_cover_all_pages(self):
+        self.assertEqual(extract_lib.page_ranges(20, 3, min_pages=5),
+                         [(1, 7), (8, 14), (15, 20)])
+        self.assertEqual(extract_lib.page_ranges(20, 8, min_pages=5),
+                         [(1, 5), (6, 10), (11, 15), (16, 20)])
+        self.assertEqual(extract_lib.page_ranges(3, 8), [(1, 3)])
+
+    def test_parallel_ranges_match_a_single_pass(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            programs = {}
+            for name, script in [("pdfinfoProgram", FAKE_PDFINFO),
+                                 ("pdftotextProgram", FAKE_PDFTOTEXT)]:
+                path = os.path.join(temp_dir, name)
+                with open(path, "w") as f:
+                    f.write(script)
+                os.chmod(path, 0o755)
+                programs[name] = getattr(pdfdiff, name)
+                setattr(pdfdiff, name, path)
+            pdf_path = os.path.join(temp_dir, "paper.pdf")
+            with open(pdf_path, "w") as f:
+                f.write("%PDF-1.4\n")
+            try:
+                single_pass = extract_lib.extract_text(pdf_path)
+                self.assertEqual(extract_lib.extract_text(pdf_path, 3),
+                                 single_pass)
+            finally:
+                for name, program in programs.items():
+                    setattr(pdfdiff, name, program)
+        self.assertIn("starts on page 10 and ends on page 11.", single_pass)
+
+
+class TestCacheText(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.blob_store = scc_lib.BlobStore(
+            os.path.join(self.temp_dir.name, "blobs"))
+        self.paths = []
+        for forum in ["a", "b"]:
+            os.makedirs(os.path.join(self.temp_dir.name, forum))
+            self.paths.append(
+                os.path.join(self.temp_dir.name, forum, "final.pdf"))
+            with open(self.paths[-1], "w") as f:
+                f.write("Same text in\nboth forums.\n")
+        self.extracted = []
+        self.extract_text = extract_lib.extract_text
+        extract_lib.extract_text = self.counting_extract_text
+
+    def tearDown(self):
+        extract_lib.extract_text = self.extract_text
+        self.temp_dir.cleanup()
+
+    def counting_extract_text(self, pdf_path, page_workers=1):
+        self.extracted.append(pdf_path)
+        return self.extract_text(pdf_path, page_workers)
+
+    def test_identical_pdfs_are_extracted_once(self):
+        keys = [
+            extract_lib.cache_text(path, self.blob_store)
+            for path in self.paths
+        ]
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(self.extracted, self.paths[:1])
+        with open(self.blob_store.path(*keys[0])) as f:
+            self.assertEqual(f.read(), "Same text in both forums. ")
+
+    def test_new_extractor_version_extracts_again(self):
+        extract_lib.cache_text(self.paths[0], self.blob_store)
+        version = extract_lib.EXTRACTOR_VERSION
+        extract_lib.EXTRACTOR_VERSION += 1
+        try:
+            extract_lib.cache_text(self.paths[1], self.blob_store)
+        finally:
+            extract_lib.EXTRACTOR_VERSION = version
+        self.assertEqual(self.extracted, self.paths)
+
+
+unittest.main()
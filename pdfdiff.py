@@ -3,6 +3,11 @@
 """
 pdfdiff.py : inspect the difference between two PDF files.
 
+Changed in this copy: normalize_text is rewritten for speed, and it replaces
+every Latin ligature (U+FB00 to U+FB06) with its letters, where the original
+only replaced the ff, ffi and ffl ligatures, and only in their UTF-8 read as
+latin-1 form. Apart from ligatures, its output is the same as the original's.
+
 Copyright (C) 2007-2022 Cas Cremers
 
 This program is free software; you can redistribute it and/or
@@ -23,6 +28,9 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 """
 Module dependencies
 """
+import functools
+import re
+import shutil
 import sys
 import string
 import subprocess
@@ -51,10 +59,20 @@ diffViewers = [
     "opendiff",
 ]
 
+# File types by the bytes their files start with
+magicNumbers = [
+    (b"%PDF-", "pdf"),
+    (b"%FDF-", "pdf"),
+    (b"%!", "ps"),
+]
+
 # pdftotext program with switches
 pdftotextProgram = "pdftotext"
 pdftotextOptions = "-nopgbrk -enc UTF-8"
 
+# pdfinfo program, from the same suite, for page counts
+pdfinfoProgram = "pdfinfo"
+
 # Myname
 progName = "pdfdiff.py"
 progVersion = "0.93"
@@ -98,6 +116,13 @@ The code is split into five sections:
 # -------------------------------------------------------------------------
 
 
+class ConversionError(Exception):
+    """
+    Raised when a file cannot be turned into text, so that callers using
+    this as a library are not terminated.
+    """
+
+
 def get_viewer_list():
     """
     Return the list of viewers
@@ -112,9 +137,15 @@ def is_command_available(prg):
     Detect whether prg exists. Note that it may have switches, i.e.
     it will find "kdiff3 -a"
     """
-    cmd = "which %s" % ((prg.split())[0])
-    status, out = subprocess.getstatusoutput(cmd)
-    return status == 0
+    return find_command((prg.split())[0]) is not None
+
+
+@functools.lru_cache(maxsize=None)
+def find_command(name):
+    """
+    Path of the program name, or None. Looked up once per process.
+    """
+    return shutil.which(name)
 
 
 def find_first(plist):
@@ -137,8 +168,7 @@ def apply_command_temp(prg, options, notfound, filename, prefix="", suffix=""):
     fout = tempfile.NamedTemporaryFile(mode="w+", suffix=suffix, prefix=prefix)
 
     if not is_command_available(prg):
-        print("Error: %s" % notfound)
-        sys.exit(1)
+        raise ConversionError(notfound)
 
     cmd = '%s %s "%s" "%s"' % (prg, options, filename, fout.name)
     output = subprocess.getoutput(cmd)
@@ -156,34 +186,17 @@ def make_prefix(fname):
 
 def get_filetype(filename):
     """
-    Determine the filetype.
-    """
-    if is_command_available("file"):
-        # On systems where we have 'file', this is a nice
-        # and solid solution.
-        cmd = 'file --brief "%s"' % filename
-        output = subprocess.getoutput(cmd)
-        type = (output.split())[0].lower()
-    else:
-        # If we don't have 'file', we just take an educated
-        # guess based on the filename extension.
-        (head, tail) = os.path.split(filename)
-        (root, ext) = os.path.splitext(tail)
-        type = ext.lower()
-        if type.startswith("."):
-            type = type[1:]
-
-    # Case distinctions for possible results.
-    #
-    # Be aware we might be matching either the output from 'file' or the
-    # extension!
-    if type in ["pdf", "fdf"]:
-        return "pdf"
-    elif type in ["postscript", "ps"]:
-        return "ps"
-    else:
-        # Default assumption: text
-        return "txt"
+    Determine the filetype from the first bytes of the file, as 'file'
+    would.
+    """
+    with open(filename, "rb") as f:
+        header = f.read(16)
+
+    for magic, type in magicNumbers:
+        if header.startswith(magic):
+            return type
+    # Default assumption: text
+    return "txt"
 
 
 def fix_ff_problem(sentence):
@@ -193,63 +206,155 @@ def fix_ff_problem(sentence):
     problem (probably latex, alternatively pdftotext ought to fix it).
     For now, we just stupidly revert the weird character combos.
     """
-    sentence = sentence.replace("ﬃ", "ffi")
-    sentence = sentence.replace("ﬄ", "ffl")
-    sentence = sentence.replace("ﬀ", "ff")
-    return sentence
+    if ligatures.search(sentence) is None:
+        return sentence
+    return ligatures.sub(lambda m: ligatureLetters[m.group()], sentence)
 
 
 # -------------------------------------------------------------------------
 # 2. Text normalization
 # -------------------------------------------------------------------------
 
+# The Latin ligatures U+FB00 to U+FB06 and their letters. Each is also
+# replaced in UTF-8 read as latin-1, as this file once did by mistake.
+ligatureLetters = {
+    form: letters
+    for ligature, letters in zip("\ufb00\ufb01\ufb02\ufb03\ufb04\ufb05\ufb06",
+                                 ["ff", "fi", "fl", "ffi", "ffl", "st", "st"])
+    for form in [ligature,
+                 ligature.encode("utf-8").decode("latin-1")]
+}
+ligatures = re.compile("|".join(map(re.escape, ligatureLetters)))
+
+# The following characters are considered to be sentence endings for our
+# normalization. Any punctuation counts as a sentence break in long
+# sentences.
+sentenceEnd = re.compile("[.!?]")
+sentenceBreak = re.compile("[%s]" % re.escape(string.punctuation))
+
+# Matched on a reversed line, finds the last word before a position.
+lastWord = re.compile("[^%s]*([%s]*)" %
+                      (string.ascii_letters, string.ascii_letters))
+
+
+class Normalizer(object):
+    """
+    Turns lines of text into lines that somewhat correspond to sentences.
+
+    Each call to normalize keeps its own state, so a Normalizer can be
+    used from several threads at once.
+    """
+
+    def __init__(self, longLength=None):
+        """
+        Sentences of longLength characters or more also end at other
+        punctuation; by default longSentenceLength.
+        """
+        if longLength is None:
+            longLength = longSentenceLength
+        self.longSentenceLength = longLength
+
+    def normalize(self, lines):
+        """
+        Yield the normalized lines, without line ends, for the lines of
+        text in the iterable lines. A paragraph break yields an empty
+        line.
+
+        Rather than looking at every character, each line is searched
+        for the next mark that may end the sentence, and sentences are
+        sliced out of the line.
+        """
+        longSentenceLength = self.longSentenceLength
+        sentence = []  # pieces of the unfinished sentence
+        sentenceLength = 0
+        wordLength = 0
+        lastWordLength = 0
+        skipEnds = False
+
+        for l in lines:
+            # Cut of spacing from both ends
+            ls = l.strip()
+
+            # Empty line or not?
+            if ls == "":
+                # This occurs when there is an empty line.
+                # We flush the sentence, and force a newline.
+                #
+                # Any further additional empty lines have no effect,
+                # which is enforced by skipEnds.
+                if not skipEnds:
+                    if sentenceLength > 0:
+                        yield fix_ff_problem("".join(sentence).lstrip())
+                    yield ""
+                    sentence = []
+                    sentenceLength = 0
+                    lastWordLength = 0
+                    skipEnds = True
+                continue
 
-def is_sentence_end(c):
-    """
-    The following characters are considered to be sentence endings for our
-    normalization.
-    """
-    return c in ".!?"
-
-
-def is_sentence_break(c):
-    """
-    The following characters are considered to be sentence breaks for our
-    normalization of long sentences.
-    """
-    return c in string.punctuation
-
-
-def is_sentence_done(sentence):
-    """
-    Detect whether the sentence is done
-    """
-    global longSentenceLength
-
-    if len(sentence) > 0:
-        if is_sentence_end(sentence[-1]):
-            return True
-        else:
-            if len(sentence) >= longSentenceLength:
-                if is_sentence_break(sentence[-1]):
-                    return True
-    return False
-
-
-def flush_sentence(fout, forceNewLine=False):
-    """
-    Flush the sentence buffer.
-    """
-    global sentenceBuf
-    global lastWordLength
+            # The file line is not empty, so this is some sort of
+            # paragraph. The line's own end can not have spacing.
+            skipEnds = False
+            if sentenceLength > 0:
+                sentence.append(" ")
+                sentenceLength += 1
+
+            # The length of the word before a sentence end is found by
+            # matching backwards from it on the reversed line, up to where
+            # the line was last scanned.
+            n = len(ls)
+            reversedLine = ls[::-1]
+            start = 0  # of the part of the line not yet in sentence
+            scanned = 0  # up to where words were looked for
+            while True:
+                # Any punctuation ends a sentence once it is long enough.
+                longFrom = start + longSentenceLength - sentenceLength - 1
+                m = None
+                if scanned < longFrom:
+                    m = sentenceEnd.search(ls, scanned, longFrom)
+                else:
+                    longFrom = scanned
+                if m is None:
+                    m = sentenceBreak.search(ls, longFrom)
+                    if m is None:
+                        break
+
+                # Some admin to know how long the last word was. Words
+                # continue over line ends.
+                w = lastWord.match(reversedLine, n - m.start(), n - scanned)
+                if w.group(1):
+                    lastWordLength = len(w.group(1))
+                    if w.end() == n:
+                        lastWordLength += wordLength
+                scanned = m.end()
+
+                # If the last word is only a single character, it's
+                # assumed that the punctuation does not refer to a
+                # sentence end.
+                if lastWordLength != 1:
+                    # Sentence has ended, so flush it.
+                    sentence.append(ls[start:scanned])
+                    yield fix_ff_problem("".join(sentence).lstrip())
+                    sentence = []
+                    sentenceLength = 0
+                    lastWordLength = 0
+                    start = scanned
+
+            # The rest of the line, and the word running on into the next.
+            w = lastWord.match(reversedLine, 0, n - scanned)
+            if w.group(1):
+                lastWordLength = len(w.group(1))
+                if w.end() == n:
+                    lastWordLength += wordLength
+            if w.group(1) and w.start(1) == 0:
+                wordLength = lastWordLength
+            else:
+                wordLength = 0
+            sentence.append(ls[start:])
+            sentenceLength += n - start
 
-    lastWordLength = 0
-    l = sentenceBuf.lstrip()
-    l = fix_ff_problem(l)
-    fout.write(l)
-    if forceNewLine or (sentenceBuf != ""):
-        fout.write("\n")
-    sentenceBuf = ""
+        if sentenceLength > 0:
+            yield fix_ff_problem("".join(sentence).lstrip())
 
 
 def normalize_text(fin, fout):
@@ -257,61 +362,9 @@ def normalize_text(fin, fout):
     Normalize the lines read from fin, and output to fout, which
     are file handles.
     """
-    global sentenceBuf
-    global lastWordLength
-
-    sentenceBuf = ""  # stores unfinished sentences
-    wordLength = 0
-    lastWordLength = 0
-    skipEnds = False
-
-    # Alternatively, we could use xreadlines, if the files are really
-    # really huge.
-    for l in fin.readlines():
-        # Cut of spacing from both ends
-        ls = l.strip()
-
-        # Empty line or not?
-        if ls == "":
-            # This occurs when there is an empty line.
-            # We flush the sentence, and force a newline.
-            #
-            # Any further additional empty lines have no effect,
-            # which is enforced by skipEnds.
-            if not skipEnds:
-                flush_sentence(fout)
-                flush_sentence(fout, True)
-                skipEnds = True
-        else:
-            # The file line is not empty, so this is some sort of
-            # paragraph
-            skipEnds = False
-            if sentenceBuf != "":
-                if not sentenceBuf[-1] in string.whitespace:
-                    sentenceBuf += " "
-
-            for c in ls:
-                # Append the character to the current buffer.
-                sentenceBuf += c
-
-                # Some admin to know how long the last word was.
-                if c in string.ascii_letters:
-                    wordLength += 1
-                    lastWordLength = wordLength
-                else:
-                    wordLength = 0
-
-                if is_sentence_done(sentenceBuf):
-                    # If the last word is only a single character,
-                    # it's assumed that the punctuation does not
-                    # refer to a sentence end.
-                    if lastWordLength != 1:
-                        # Sentence has ended, so flush it.
-                        # We should skip any spacing directly after
-                        # the sentence end mark.
-                        flush_sentence(fout)
-
-    flush_sentence(fout)
+    for l in Normalizer().normalize(fin):
+        fout.write(l)
+        fout.write("\n")
     fout.flush()
 
 
@@ -331,9 +384,12 @@ def ps_to_pdf(filename, prefix=""):
     return fout
 
 
-def pdf_to_text(filename, prefix=""):
+def pdf_to_text(filename, firstPage=None, lastPage=None):
     """
-    pdf to text conversion
+    pdf to text conversion, of all pages or from firstPage to lastPage
+
+    Yields the lines of text as pdftotext writes them to its stdout, so
+    that nothing is written to disk or held in memory as a whole.
     """
     global pdftotextProgram, pdftotextOptions
 
@@ -345,30 +401,58 @@ Could not find '%s', which is needed for pdf to text conversion.
         pdftotextProgram,
         pdftotextProgram,
     )
-    (fout, output) = apply_command_temp(pdftotextProgram, pdftotextOptions,
-                                        notfound, filename, prefix, ".txt")
-    return fout
-
-
-def normalize_anything(filename, fout=sys.stdout):
-    """
-    This function takes any file type and tries to apply converters
-    until we can finall churn out normalized text.
+    if not is_command_available(pdftotextProgram):
+        raise ConversionError(notfound)
+
+    cmd = [pdftotextProgram] + pdftotextOptions.split()
+    if firstPage is not None:
+        cmd += ["-f", str(firstPage)]
+    if lastPage is not None:
+        cmd += ["-l", str(lastPage)]
+    cmd += [filename, "-"]
+    with subprocess.Popen(cmd,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL,
+                          encoding="utf-8") as process:
+        yield from process.stdout
+    if process.returncode != 0:
+        raise ConversionError("%s failed on '%s' with exit status %d" %
+                              (pdftotextProgram, filename, process.returncode))
+
+
+def pdf_page_count(filename):
+    """
+    Number of pages in a pdf, from pdfinfo
+    """
+    global pdfinfoProgram
+
+    if not is_command_available(pdfinfoProgram):
+        raise ConversionError(
+            "Could not find '%s', which is needed to count pdf pages." %
+            pdfinfoProgram)
+    result = subprocess.run([pdfinfoProgram, filename],
+                            capture_output=True,
+                            encoding="utf-8",
+                            errors="replace")
+    m = re.search(r"^Pages:\s*(\d+)\s*$", result.stdout, re.MULTILINE)
+    if result.returncode != 0 or m is None:
+        raise ConversionError("%s could not count the pages of '%s'" %
+                              (pdfinfoProgram, filename))
+    return int(m.group(1))
+
+
+def text_lines(filename):
+    """
+    Yield the lines of text of any file type, applying converters as
+    needed.
     """
     prefix = make_prefix(filename)
     filetype = get_filetype(filename)
 
-    # Iterate until we have text
+    # Iterate until we have pdf or text
     temphandle = None
-    fhandle = None
-    while filetype != "txt":
-        if filetype == "pdf":
-            fhandle = pdf_to_text(filename, prefix=prefix)
-        elif filetype == "ps":
-            fhandle = ps_to_pdf(filename, prefix=prefix)
-        else:
-            print("Error: Don't know how to handle file type '%s'" % filetype)
-            sys.exit(1)
+    while filetype == "ps":
+        fhandle = ps_to_pdf(filename, prefix=prefix)
         if temphandle:
             temphandle.close()
 
@@ -377,11 +461,27 @@ def normalize_anything(filename, fout=sys.stdout):
         # Store for destruction of intermediate objects later
         temphandle = fhandle
 
-    if not fhandle:
-        fhandle = open(filename, "r")
+    try:
+        if filetype == "pdf":
+            yield from pdf_to_text(filename)
+        elif filetype == "txt":
+            with open(filename, "r") as fhandle:
+                yield from fhandle
+        else:
+            raise ConversionError("Don't know how to handle file type '%s'" %
+                                  filetype)
+    finally:
+        if temphandle:
+            temphandle.close()
+
 
-    # Now fhandle is considered text
-    normalize_text(fhandle, fout)
+def normalize_anything(filename, fout=sys.stdout):
+    """
+    This function takes any file type and tries to apply converters
+    until we can finall churn out normalized text.
+    """
+    # Converted text goes straight into the normalization
+    normalize_text(text_lines(filename), fout)
 
 
 def normalize_anything_tempfile(filename):
@@ -399,13 +499,12 @@ def normalize_anything_tempfile(filename):
 # -------------------------------------------------------------------------
 
 
-def view_diff(fnleft, fnright):
+def view_diff(fnleft, fnright, diffViewerPrefix=""):
     """
     Show the diff between two files using the first program that is
-    found.
+    found, preferring ones that start with diffViewerPrefix.
     """
     global diffViewers
-    global diffViewerPrefix
 
     fleft = normalize_anything_tempfile(fnleft)
     fright = normalize_anything_tempfile(fnright)
@@ -476,8 +575,6 @@ if __name__ == "__main__":
     """
     Main code
     """
-    global diffViewerPrefix
-
     args = sys.argv[1:]
     diffViewerPrefix = ""
 
@@ -516,15 +613,18 @@ if __name__ == "__main__":
 
         else:
             # Default mode: 1 argument is normalize, 2 is diff
-            if len(args) == 1:
-                normalize_anything(args[0])
-                sys.exit(0)
-            elif len(args) == 2:
-                view_diff(args[0], args[1])
-                sys.exit(0)
-            else:
+            if len(args) > 2:
                 print(
                     "Error: I don't know what to do with more than two files")
                 sys.exit(1)
+            try:
+                if len(args) == 1:
+                    normalize_anything(args[0])
+                else:
+                    view_diff(args[0], args[1], diffViewerPrefix)
+            except ConversionError as e:
+                print("Error: %s" % e)
+                sys.exit(1)
+            sys.exit(0)
 
 # vim: set ts=4 sw=4 et fileencoding=utf-8 list lcs=tab\:>-:
@@ -0,0 +1,116 @@
+import io
+import os
+import random
+import tempfile
+import unittest
+
+import benchmark_normalize
+import pdfdiff
+
+
+class TestNormalizeText(unittest.TestCase):
+
+    def assertSameAsReference(self, text):
+        # The reference left most ligatures alone
+        self.assertEqual(
+            benchmark_normalize.normalize(pdfdiff.normalize_text, text),
+            pdfdiff.fix_ff_problem(
+                benchmark_normalize.normalize(
+                    benchmark_normalize.reference_normalize_text, text)))
+
+    def test_sentences_and_paragraphs(self):
+        fout = io.StringIO()
+        pdfdiff.normalize_text(
+            io.StringIO("First line of a\nsentence. J. Smith wrote it!\n\n\n"
+                        "  Next paragraph.\n"), fout)
+        self.assertEqual(
+            fout.getvalue(), "First line of a sentence.\n"
+            "J. Smith wrote it!\n\nNext paragraph.\n")
+
+    def test_ligatures(self):
+        fout = io.StringIO()
+        pdfdiff.normalize_text(
+            io.StringIO("An eﬃcient, diﬀerent waﬄe. A ﬁne, "
+                        "ﬂat di\u00ef\u00ac\x80erent one.\n"), fout)
+        self.assertEqual(
+            fout.getvalue(),
+            "An efficient, different waffle. A fine, flat different one.\n")
+
+    def test_normalizer_yields_lines(self):
+        self.assertEqual(
+            list(pdfdiff.Normalizer().normalize(["A b c.", "", "Next"])),
+            ["A b c.", "", "Next"])
+        self.assertEqual(
+            list(
+                pdfdiff.Normalizer(longLength=5).normalize(
+                    ["Long enough, short, end"])),
+            ["Long enough,", "short,", "end"])
+
+    def test_interleaved_normalizations_are_independent(self):
+        text = benchmark_normalize.synthetic_text(200)
+        expected = list(pdfdiff.Normalizer().normalize(text.splitlines()))
+        normalizer = pdfdiff.Normalizer()
+        first = normalizer.normalize(text.splitlines())
+        second = normalizer.normalize(text.splitlines())
+        self.assertEqual([l for pair in zip(first, second) for l in pair],
+                         [l for l in expected for _ in range(2)])
+
+    def test_same_as_reference_on_synthetic_text(self):
+        self.assertSameAsReference(benchmark_normalize.synthetic_text(2000))
+
+    def test_same_as_reference_on_random_characters(self):
+        # Few distinct characters, so that single letter words, words
+        # running over line ends and long sentences all come up.
+        rng = random.Random(0)
+        alphabet = "ab  .,;!?-\n\nﬃﬁ\t\u00ef\u00ac\x81"
+        for _ in range(300):
+            self.assertSameAsReference("".join(
+                rng.choice(alphabet) for _ in range(rng.randint(0, 400))))
+
+
+class TestNormalizeAnything(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.temp_dir.name, "paper.pdf")
+        with open(self.pdf_path, "w") as f:
+            f.write("%PDF-1.4\nSome text\nof a paper.\n")
+        self.program = pdfdiff.pdftotextProgram
+        self.options = pdfdiff.pdftotextOptions
+        pdfdiff.pdftotextOptions = ""
+
+    def tearDown(self):
+        pdfdiff.pdftotextProgram = self.program
+        pdfdiff.pdftotextOptions = self.options
+        self.temp_dir.cleanup()
+
+    def use_fake_pdftotext(self, script):
+        pdfdiff.pdftotextProgram = os.path.join(self.temp_dir.name,
+                                                "pdftotext")
+        with open(pdfdiff.pdftotextProgram, "w") as f:
+            f.write("#!/bin/sh\n" + script)
+        os.chmod(pdfdiff.pdftotextProgram, 0o755)
+
+    def test_pdftotext_output_is_streamed(self):
+        # The fake writes all but the header of the pdf to its stdout, when
+        # asked to
+        self.use_fake_pdftotext('[ "$2" = "-" ] && tail -n +2 "$1"\n')
+        fout = io.StringIO()
+        pdfdiff.normalize_anything(self.pdf_path, fout)
+        self.assertEqual(fout.getvalue(), "Some text of a paper.\n")
+
+    def test_filetype_from_magic_bytes(self):
+        ps_path = os.path.join(self.temp_dir.name, "paper.pdf.ps")
+        with open(ps_path, "w") as f:
+            f.write("%!PS-Adobe-3.0\n")
+        self.assertEqual(pdfdiff.get_filetype(self.pdf_path), "pdf")
+        self.assertEqual(pdfdiff.get_filetype(ps_path), "ps")
+        self.assertEqual(pdfdiff.get_filetype(__file__), "txt")
+
+    def test_pdftotext_failure(self):
+        self.use_fake_pdftotext("exit 3\n")
+        with self.assertRaises(pdfdiff.ConversionError):
+            pdfdiff.normalize_anything(self.pdf_path, io.StringIO())
+
+
+unittest.main()
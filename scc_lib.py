@@ -1,6 +1,27 @@
-import stanza
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
 
-SENTENCIZE_PIPELINE = stanza.Pipeline("en", processors="tokenize")
+
+@functools.lru_cache(maxsize=None)
+def get_sentencize_pipeline():
+    # Loading stanza and its model takes seconds, so only do it when needed
+    import stanza
+    return stanza.Pipeline("en", processors="tokenize")
+
+
+def sentencize_batch(texts):
+    """Sentencize many texts in one pipeline call; one Document per text."""
+    import stanza
+    return get_sentencize_pipeline()(
+        [stanza.Document([], text=text) for text in texts])
 
 
 class Conference(object):
@@ -13,3 +34,351 @@ class Conference(object):
 
 
 INITIAL, FINAL = "initial final".split()
+
+# == Content-addressed storage ===============================================
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Read once, as os.umask can only read the umask by setting it, which is not
+# safe once there are threads
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+
+def replace_with_temp_file(temp_path, path):
+    """Move a file made by tempfile.mkstemp to `path`.
+
+    mkstemp creates files readable by their owner only; they get the mode
+    open() would have given them first.
+    """
+    os.chmod(temp_path, 0o666 & ~UMASK)
+    os.replace(temp_path, path)
+
+
+def write_atomically(path, data):
+    """Write `data` (str or bytes) so that readers never see a partial file.
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        replace_with_temp_file(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def write_if_changed(path, data):
+    """Write `data` with write_atomically, unless `path` already holds it, so
+    that an unchanged file keeps its mtime. Returns whether it was written.
+    """
+    try:
+        with open(path, 'rb' if isinstance(data, bytes) else 'r') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    write_atomically(path, data)
+    return True
+
+
+class BlobStore(object):
+    """Files stored once, under the SHA-256 digest of their contents.
+
+    A blob lives at <root>/<digest[:2]>/<digest>.pdf. Outputs derived from a
+    blob (e.g. its extracted text) are stored next to it with a different
+    suffix, so every forum that links the same bytes can reuse them.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest, suffix='.pdf'):
+        return os.path.join(self.root, digest[:2], f'{digest}{suffix}')
+
+    def put_file(self, path):
+        """Move the file at `path` into the store, returning its digest.
+
+        `path` should be on the same filesystem as the store, e.g. in a
+        staging directory under its root. If the blob is already stored the
+        file is just removed, so existing hardlinks keep sharing the blob.
+        """
+        digest = file_sha256(path)
+        blob_path = self.path(digest)
+        if os.path.exists(blob_path):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(path, blob_path)
+        return digest
+
+    def staging_dir(self):
+        """A temporary directory under the root, for files that may or may
+        not be put into the store; it is removed with whatever is left in it.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        return tempfile.TemporaryDirectory(dir=self.root, prefix='.tmp_')
+
+    def put_derived(self, digest, suffix, data):
+        path = self.path(digest, suffix)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomically(path, data)
+        return path
+
+    def link(self, digest, target_path, suffix='.pdf'):
+        """Make `target_path` point to a stored file, replacing it if needed.
+
+        Hardlinks are used where possible; across filesystems the file is
+        copied instead.
+        """
+        source_path = self.path(digest, suffix)
+        temp_path = f'{target_path}.tmp_link'
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        try:
+            os.link(source_path, temp_path)
+        except OSError:
+            shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, target_path)
+
+
+# == Journals ================================================================
+
+
+class Journal(object):
+    """Append-only log of JSON records, one per line, keyed by `key`.
+
+    Records are flushed and fsync'd before `append` returns, so a crash loses
+    at most the records that were still in flight. A torn last line left by a
+    crash is ignored on load.
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self._lock = threading.Lock()
+        if os.path.isfile(path) and os.path.getsize(path):
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b'\n'
+            if torn:
+                # Terminate the torn line so the next record starts cleanly
+                with open(path, 'a') as f:
+                    f.write('\n')
+
+    def load(self):
+        """Map from key to its latest record."""
+        records = {}
+        if not os.path.isfile(self.path):
+            return records
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[record[self.key]] = record
+        return records
+
+    def append(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+# == Per-document limits =====================================================
+
+
+class LimitExceeded(Exception):
+    """A document took too long, used too much memory or killed its worker.
+    """
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of process `pid` and all its descendants.
+
+    Read from /proc; processes that are gone, or a system without /proc,
+    count as 0.
+    """
+    total = 0
+    pids = [pid]
+    while pids:
+        pid = pids.pop()
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f'/proc/{pid}/task'):
+                with open(f'/proc/{pid}/task/{task}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def _serve(connection, initializer, initargs):
+    # A process group of its own, so the worker is killed together with
+    # anything it started, e.g. pdftotext
+    os.setpgrp()
+    if initializer is not None:
+        initializer(*initargs)
+    connection.send(None)
+    while True:
+        try:
+            function, args = connection.recv()
+        except EOFError:
+            return
+        try:
+            result = (True, function(*args))
+        except Exception as e:
+            result = (False, e)
+        try:
+            connection.send(result)
+        except Exception as e:
+            # Results or exceptions that can not be pickled
+            connection.send((False, RuntimeError(repr(e))))
+
+
+class LimitedWorker(object):
+    """Runs calls one at a time in a child process, under limits.
+
+    A call that runs longer than `timeout` seconds, or during which the
+    worker and the processes it started use more than `max_rss` bytes of
+    resident memory, kills the worker and raises LimitExceeded; the next
+    call starts a new one. `initializer(*initargs)` runs in every new worker
+    before its first call, e.g. to load a model once.
+
+    Exceptions raised by a call are raised again in the caller.
+    """
+    POLL_INTERVAL = 0.1
+
+    def __init__(self,
+                 timeout=None,
+                 max_rss=None,
+                 initializer=None,
+                 initargs=()):
+        self.timeout = timeout
+        self.max_rss = max_rss
+        self.initializer = initializer
+        self.initargs = initargs
+        self._process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """Start the worker now rather than on the first call."""
+        if self._process is not None:
+            return
+        context = multiprocessing.get_context('fork')
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=_serve,
+                                        args=(child_connection,
+                                              self.initializer, self.initargs),
+                                        daemon=True)
+        self._process.start()
+        child_connection.close()
+        try:
+            self._connection.recv()
+        except EOFError:
+            self._stop()
+            raise RuntimeError('worker failed to start')
+
+    def close(self):
+        if self._process is not None:
+            self._stop()
+
+    def _stop(self):
+        try:
+            os.killpg(self._process.pid, signal.SIGKILL)
+        except OSError:
+            self._process.kill()
+        self._process.join()
+        self._connection.close()
+        self._process = None
+
+    def _exceeded(self, deadline):
+        if deadline is not None and time.monotonic() > deadline:
+            return f'took longer than {self.timeout:g}s'
+        if (self.max_rss is not None
+                and process_tree_rss(self._process.pid) > self.max_rss):
+            return f'used more than {self.max_rss >> 20} MB'
+        return None
+
+    def call(self, function, *args):
+        if self._process is not None and not self._process.is_alive():
+            # Killed from outside while idle
+            self._stop()
+        self.start()
+        try:
+            self._connection.send((function, args))
+        except OSError as e:
+            self._stop()
+            raise LimitExceeded(f'worker could not be reached: {e}')
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.monotonic() + self.timeout
+        while not self._connection.poll(self.POLL_INTERVAL):
+            reason = self._exceeded(deadline)
+            if reason is not None:
+                self._stop()
+                raise LimitExceeded(reason)
+        try:
+            ok, value = self._connection.recv()
+        except EOFError:
+            # Killed from outside, e.g. by the kernel when out of memory
+            exitcode = self._process.exitcode
+            self._stop()
+            raise LimitExceeded(f'worker died with exit code {exitcode}')
+        if ok:
+            return value
+        raise value
+
+
+class Quarantine(object):
+    """Files that exceeded a limit, and why, so later runs can skip them.
+
+    Files are identified by their contents, so a copy elsewhere is skipped
+    too and a fixed file with the same name is not. Only files with the size
+    of a quarantined one are hashed.
+    """
+
+    def __init__(self, path):
+        self.journal = Journal(path, key='sha256')
+        self.records = self.journal.load()
+        self._sizes = {record['size'] for record in self.records.values()}
+
+    def reason(self, path):
+        """Why `path` was quarantined, or None."""
+        if os.path.getsize(path) not in self._sizes:
+            return None
+        record = self.records.get(file_sha256(path))
+        return None if record is None else record['reason']
+
+    def add(self, path, reason):
+        record = {
+            'sha256': file_sha256(path),
+            'size': os.path.getsize(path),
+            'path': path,
+            'reason': reason,
+            'time': time.time(),
+        }
+        self.journal.append(record)
+        self.records[record['sha256']] = record
+        self._sizes.add(record['size'])
@@ -0,0 +1,117 @@
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import scc_lib
+
+
+class TestBlobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = scc_lib.BlobStore(f'{self.temp_dir.name}/blobs')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def put(self, binary):
+        path = f'{self.temp_dir.name}/staged.pdf'
+        with open(path, 'wb') as f:
+            f.write(binary)
+        return self.store.put_file(path)
+
+    def test_identical_binaries_are_stored_once(self):
+        digest = self.put(b'%PDF-1.4 same')
+        self.assertEqual(self.put(b'%PDF-1.4 same'), digest)
+        self.assertEqual(os.listdir(os.path.dirname(self.store.path(digest))),
+                         [f'{digest}.pdf'])
+
+    def test_link_points_forum_files_at_the_blob(self):
+        digest = self.put(b'%PDF-1.4 linked')
+        for version in ['initial', 'final']:
+            self.store.link(digest, f'{self.temp_dir.name}/{version}.pdf')
+        self.assertEqual(
+            scc_lib.file_sha256(f'{self.temp_dir.name}/final.pdf'), digest)
+        self.assertEqual(os.stat(self.store.path(digest)).st_nlink, 3)
+
+    def test_unchanged_files_are_not_rewritten(self):
+        path = f'{self.temp_dir.name}/final.txt'
+        self.assertTrue(scc_lib.write_if_changed(path, 'text'))
+        os.utime(path, ns=(0, 0))
+        self.assertFalse(scc_lib.write_if_changed(path, 'text'))
+        self.assertEqual(os.stat(path).st_mtime_ns, 0)
+        self.assertTrue(scc_lib.write_if_changed(path, 'new text'))
+
+    def test_files_get_the_default_mode(self):
+        path = f'{self.temp_dir.name}/metadata.json'
+        scc_lib.write_atomically(path, '{}')
+        digest = self.put(b'%PDF-1.4 shared')
+        for written in [path, self.store.path(digest)]:
+            self.assertEqual(
+                os.stat(written).st_mode & 0o777, 0o666 & ~scc_lib.UMASK)
+
+    def test_staged_files_are_kept_only_when_put(self):
+        with self.store.staging_dir() as staging_dir:
+            for name in ['kept', 'dropped']:
+                with open(f'{staging_dir}/{name}.pdf', 'wb') as f:
+                    f.write(f'%PDF-1.4 {name}'.encode())
+            digest = self.store.put_file(f'{staging_dir}/kept.pdf')
+        self.assertEqual(scc_lib.file_sha256(self.store.path(digest)), digest)
+        self.assertEqual([
+            name for _, _, names in os.walk(self.store.root) for name in names
+        ], [f'{digest}.pdf'])
+
+
+class TestLimitedWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.worker = scc_lib.LimitedWorker(timeout=2, max_rss=200 << 20)
+
+    def tearDown(self):
+        self.worker.close()
+
+    def test_results_and_errors_are_passed_back(self):
+        self.assertEqual(self.worker.call(len, 'abc'), 3)
+        with self.assertRaises(ValueError):
+            self.worker.call(int, 'x')
+
+    def test_slow_call_is_killed_and_worker_replaced(self):
+        with self.assertRaises(scc_lib.LimitExceeded):
+            self.worker.call(time.sleep, 10)
+        self.assertEqual(self.worker.call(len, 'ab'), 2)
+
+    def test_worker_killed_while_idle_is_replaced(self):
+        self.worker.start()
+        os.kill(self.worker._process.pid, signal.SIGKILL)
+        self.worker._process.join()
+        self.assertEqual(self.worker.call(len, 'ab'), 2)
+        self.assertEqual(self.worker.call(len, 'abc'), 3)
+
+    def test_memory_of_child_processes_counts(self):
+        hog = 'b = bytearray(300 << 20); import time; time.sleep(10)'
+        with self.assertRaises(scc_lib.LimitExceeded) as error:
+            self.worker.call(subprocess.run, [sys.executable, '-c', hog])
+        self.assertIn('MB', str(error.exception))
+
+
+class TestQuarantine(unittest.TestCase):
+
+    def test_quarantined_contents_are_remembered(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = f'{temp_dir}/quarantine.jsonl'
+            for name, contents in [('slow', b'%PDF slow'),
+                                   ('ok', b'%PDF ok!')]:
+                with open(f'{temp_dir}/{name}.pdf', 'wb') as f:
+                    f.write(contents)
+            scc_lib.Quarantine(path).add(f'{temp_dir}/slow.pdf', 'timeout')
+            quarantine = scc_lib.Quarantine(path)
+            self.assertEqual(quarantine.reason(f'{temp_dir}/slow.pdf'),
+                             'timeout')
+            self.assertIsNone(quarantine.reason(f'{temp_dir}/ok.pdf'))
+
+
+unittest.main()
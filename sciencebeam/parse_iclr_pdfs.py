@@ -6,6 +6,7 @@ from sciencebeam_parser.config.config import AppConfig
 from sciencebeam_parser.utils.media_types import MediaTypes
 from sciencebeam_parser.app.parser import ScienceBeamParser
 
+import argparse
 import collections
 import glob
 import json
@@ -13,6 +14,36 @@ import os
 import tqdm
 import xml.etree.ElementTree as ET
 
+# scc_lib is at the top of the repo; from there, run
+#   PYTHONPATH=. python sciencebeam/parse_iclr_pdfs.py -d forums/
+import scc_lib
+
+parser = argparse.ArgumentParser(description="")
+parser.add_argument("-d",
+                    "--data_dir",
+                    default="/gypsum/work1/mccallum/nnayak/forums/",
+                    type=str,
+                    help="Data dir")
+parser.add_argument("-b",
+                    "--blob_dir",
+                    default=None,
+                    type=str,
+                    help="blob store of 00_get_revisions.py; pdfs with "
+                    "identical contents are only parsed once")
+parser.add_argument("--timeout",
+                    default=600,
+                    type=float,
+                    help="seconds a pdf may take before it is given up on "
+                    "and quarantined; 0 for no limit")
+parser.add_argument("--max_rss",
+                    default=8192,
+                    type=int,
+                    help="MB of memory parsing a pdf may use before it is "
+                    "given up on and quarantined; 0 for no limit")
+parser.add_argument("--force",
+                    action="store_true",
+                    help="also try quarantined pdfs again")
+
 PREFIX = "{http://www.tei-c.org/ns/1.0}"
 TEXT_ID = f"{PREFIX}text"
 BODY_ID = f"{PREFIX}body"
@@ -21,6 +52,7 @@ HEAD_ID = f"{PREFIX}head"
 P_ID = f"{PREFIX}p"
 NOTE_ID = f"{PREFIX}note"
 FORMULA_ID = f'{PREFIX}formula'
+SBRAW_SUFFIX = '_sbraw.json'
 
 Section = collections.namedtuple("Section", "title number text".split())
 
@@ -63,29 +95,72 @@ def parse_xml(filename):
     return [section.as_json() for section in sections]
 
 
-def main():
+# Loaded once in every worker process
+sciencebeam_parser = None
+
+
+def load_parser():
+    global sciencebeam_parser
     config = AppConfig.load_yaml(DEFAULT_CONFIG_FILE)
     sciencebeam_parser = ScienceBeamParser.from_config(config)
 
-    for initial_filename in tqdm.tqdm(
-        list(
-        glob.glob('/gypsum/work1/mccallum/nnayak/forums/*/initial.pdf'))):
-
-        for filename in [initial_filename,
-            initial_filename.replace('initial.pdf', 'final.pdf')]:
-            output_filename = filename.replace('.pdf', '_sbraw.json')
-            if os.path.exists(output_filename):
-                continue
-
-            try:
-                with sciencebeam_parser.get_new_session() as session:
-                    session_source = session.get_source(
-                        filename, MediaTypes.PDF)
-                    converted_file = session_source.get_local_file_for_response_media_type(
-                        MediaTypes.TEI_XML)
-                    with open(output_filename, 'w') as f:
-                        json.dump(parse_xml(converted_file), f)
-            except Exception as e:
-                print("Error", filename)
+
+def parse_pdf(filename):
+    with sciencebeam_parser.get_new_session() as session:
+        session_source = session.get_source(filename, MediaTypes.PDF)
+        converted_file = session_source.get_local_file_for_response_media_type(
+            MediaTypes.TEI_XML)
+        return json.dumps(parse_xml(converted_file))
+
+
+def main():
+    args = parser.parse_args()
+    quarantine = scc_lib.Quarantine(
+        f'{args.data_dir}/sciencebeam_quarantine.jsonl')
+    blob_store = None
+    if args.blob_dir is not None:
+        blob_store = scc_lib.BlobStore(args.blob_dir)
+
+    # A pdf that hangs the parser or makes it use too much memory gets the
+    # worker killed, and is skipped in later runs
+    with scc_lib.LimitedWorker(timeout=args.timeout or None,
+                               max_rss=args.max_rss << 20 or None,
+                               initializer=load_parser) as worker:
+        for initial_filename in tqdm.tqdm(
+                list(glob.glob(f'{args.data_dir}/*/initial.pdf'))):
+
+            for filename in [
+                    initial_filename,
+                    initial_filename.replace('initial.pdf', 'final.pdf')
+            ]:
+                output_filename = filename.replace('.pdf', SBRAW_SUFFIX)
+                if os.path.exists(output_filename):
+                    continue
+
+                try:
+                    if (not args.force
+                            and quarantine.reason(filename) is not None):
+                        continue
+                    if blob_store is None:
+                        # Parsed first, so a failure leaves no empty output
+                        parsed = worker.call(parse_pdf, filename)
+                        with open(output_filename, 'w') as f:
+                            f.write(parsed)
+                    else:
+                        # Identical pdfs share one parse in the blob store
+                        digest = scc_lib.file_sha256(filename)
+                        if not os.path.exists(
+                                blob_store.path(digest, SBRAW_SUFFIX)):
+                            blob_store.put_derived(
+                                digest, SBRAW_SUFFIX,
+                                worker.call(parse_pdf, filename))
+                        blob_store.link(digest, output_filename, SBRAW_SUFFIX)
+                except scc_lib.LimitExceeded as e:
+                    print("Error", filename, e)
+                    quarantine.add(filename, str(e))
+                except Exception as e:
+                    print("Error", filename)
+
+
 if __name__ == "__main__":
     main()